@@ -0,0 +1,284 @@
+"""
+Пакетное решение задач по манифесту.
+
+Манифест - файл JSON lines, каждая строка которого описывает задачу:
+
+    {"id": "site-1-a", "terminal_points": "site-1.txt", "quarry_capacities": [50, 100], "seed": 1, "timeout": 60,
+     "plot": "site-1-a.png"}
+
+terminal_points - файл в формате utils.read_terminal_points, путь задается относительно манифеста. Остальные поля
+необязательны: quarry_capacities - число или список объемов карьеров в порядке файла (по умолчанию
+configs.QUARRY_CAPACITY), seed - зерно сетки (по умолчанию configs.GRID_SEED), timeout - ограничение времени в
+секундах, plot - файл рисунка рассчитанной сети.
+
+Задачи решаются в пуле процессов. Сетки задач с одинаковыми терминальными точками и зерном генерируются один раз и
+разделяются через кэш сеток на диске (Grid.generate). Результаты выводятся по мере готовности, по одной строке JSON на
+задачу. matplotlib импортируется только при наличии задач с рисунками.
+
+Запуск: python batch.py manifest.jsonl [-o results.jsonl] [-j 4] [--timeout 60] [--grid-cache-dir cache]
+"""
+
+import argparse
+import contextlib
+import json
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import QhullError
+
+import configs
+import instrumentation
+import utils
+from edges_splitter import EdgesSplitter
+from grid import Grid
+from network_builder import NetworkBuilder
+
+# Сетки, уже загруженные в процессе пула. Ключ - Grid.cache_key().
+_worker_grids = OrderedDict()
+
+
+def read_manifest(path: Path):
+    """
+    Чтение задач из манифеста. Пути к файлам задач приводятся к абсолютным.
+
+    :param path:
+    :return:
+    """
+    path = Path(path)
+
+    jobs = list()
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            job = json.loads(line)
+            job.setdefault("id", str(len(jobs)))
+            job["terminal_points"] = str(path.parent / job["terminal_points"])
+            if job.get("plot") is not None:
+                job["plot"] = str(path.parent / job["plot"])
+            jobs.append(job)
+
+    return jobs
+
+
+def create_grid(job: dict) -> Grid:
+    """
+    Сетка задачи без генерации точек.
+
+    :param job:
+    :return:
+    """
+    terminal_points, quarries = utils.read_terminal_points(job["terminal_points"])
+    points = np.vstack((terminal_points, quarries))
+    quarries_indices = list(range(len(terminal_points), len(points)))
+
+    capacities = job.get("quarry_capacities", configs.QUARRY_CAPACITY)
+    if np.isscalar(capacities):
+        capacities = [capacities] * len(quarries_indices)
+    if len(capacities) != len(quarries_indices):
+        raise ValueError(f"Задача {job['id']}: задано {len(capacities)} объемов для {len(quarries_indices)} карьеров.")
+
+    return Grid(points, set(quarries_indices), seed=job.get("seed"),
+                quarry_capacities=dict(zip(quarries_indices, map(float, capacities))))
+
+
+def _init_worker(grid_cache_dir: str):
+    """
+    Инициализация процесса пула: каталог кэша сеток и обработчик сигнала для ограничения времени.
+
+    :param grid_cache_dir:
+    :return:
+    """
+    configs.GRID_CACHE_DIR = grid_cache_dir
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError
+
+
+def _get_grid(job: dict) -> Grid:
+    """
+    Сетка задачи. Сетки, уже загруженные в процессе, переиспользуются вместе с вычисленными кратчайшими путями,
+    остальные загружаются из кэша на диске или генерируются.
+
+    :param job:
+    :return:
+    """
+    grid = create_grid(job)
+    key = grid.cache_key()
+
+    cached_grid = _worker_grids.get(key)
+    if cached_grid is None:
+        grid.generate()
+        cached_grid = grid
+        _worker_grids[key] = cached_grid
+        if len(_worker_grids) > configs.BATCH_GRID_CACHE_SIZE:
+            _worker_grids.popitem(last=False)
+    _worker_grids.move_to_end(key)
+
+    return cached_grid.with_quarry_capacities(grid.quarry_capacities)
+
+
+@contextlib.contextmanager
+def _time_limit(timeout: float):
+    """
+    Ограничение времени выполнения блока: по истечении timeout секунд в блоке возбуждается TimeoutError. Без
+    SIGALRM (Windows) время не ограничивается.
+
+    :param timeout: Время в секундах или None.
+    :return:
+    """
+    has_timer = timeout is not None and hasattr(signal, "setitimer")
+    if has_timer:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        yield
+    finally:
+        if has_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _prepare_grid(job: dict):
+    """
+    Генерация сетки задачи и сохранение ее в кэш на диске с ограничением времени задачи. Ошибки чтения задачи и
+    построения сетки, а также превышение времени не прерывают пакет: они будут получены и записаны в результат при
+    решении задачи.
+
+    :param job:
+    :return:
+    """
+    try:
+        with _time_limit(job.get("timeout")):
+            create_grid(job).generate()
+    except (TimeoutError, OSError, ValueError, QhullError):
+        pass
+
+
+def solve_job(job: dict) -> dict:
+    """
+    Решение одной задачи. Ошибки и превышение времени возвращаются в поле status результата.
+
+    :param job:
+    :return: Результат: id, status, time, а для решенных задач также cost, mst_cost, edges и assignments - участки
+    рассчитанной сети с прикрепленными карьерами. При включенном инструментировании - profile, отчет
+    instrumentation.report() по задаче.
+    """
+    start_time = time.time()
+    result = {"id": job["id"]}
+    instrumentation.reset()
+
+    try:
+        with _time_limit(job.get("timeout")):
+            grid = _get_grid(job)
+            network_builder = NetworkBuilder(grid, n_workers=1)
+            mst, mst_cost = network_builder._build_mst()
+
+            splitter = EdgesSplitter(grid.create_network(mst), keep_old_road_network=job.get("plot") is not None)
+            splitter.calculate()
+            road_network = splitter.road_network
+
+            cost = utils.compute_road_network_cost(road_network)
+
+            result["status"] = "ok"
+            result["cost"] = float(cost)
+            result["mst_cost"] = float(mst_cost)
+            result["edges"] = sorted(sorted(map(int, edge)) for edge in mst.edges)
+            result["assignments"] = [
+                {"edge": sorted(map(int, key)), "quarry": int(road_network.edge_attached_quarry[key]),
+                 "length": line.length}
+                for key, line in road_network.edge_to_line_mapping.items()]
+
+            if job.get("plot") is not None:
+                _plot(splitter, job["plot"])
+    except TimeoutError:
+        result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+
+    result["time"] = time.time() - start_time
+    if instrumentation.is_enabled():
+        result["profile"] = instrumentation.report()
+
+    return result
+
+
+def _plot(splitter: EdgesSplitter, path: str):
+    """
+    Сохранение рисунка рассчитанной сети. matplotlib импортируется только здесь.
+
+    :param splitter:
+    :param path:
+    :return:
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import painter
+
+    painter.draw_calculated_road_network(splitter.road_network, Path(path))
+
+
+def solve(jobs, output, n_workers: int = None, timeout: float = None, grid_cache_dir: str = None):
+    """
+    Решение задач в пуле процессов. Результаты записываются в output по мере готовности, по одной строке JSON.
+
+    :param jobs:
+    :param output: Файловый объект для результатов.
+    :param n_workers: Число процессов, по умолчанию - число процессоров.
+    :param timeout: Ограничение времени для задач, в которых оно не задано. По умолчанию configs.BATCH_JOB_TIMEOUT.
+    :param grid_cache_dir: Каталог кэша сеток. По умолчанию configs.GRID_CACHE_DIR, а если он не задан - временный
+    каталог, удаляемый после решения.
+    :return:
+    """
+    timeout = configs.BATCH_JOB_TIMEOUT if timeout is None else timeout
+    jobs = [dict(job, timeout=job.get("timeout", timeout)) for job in jobs]
+
+    grid_cache_dir = configs.GRID_CACHE_DIR if grid_cache_dir is None else grid_cache_dir
+    with contextlib.ExitStack() as stack:
+        if grid_cache_dir is None:
+            grid_cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        pool = stack.enter_context(Pool(n_workers, initializer=_init_worker, initargs=(str(grid_cache_dir),)))
+
+        # Сначала по одной сетке на площадку, чтобы процессы не генерировали одну и ту же сетку одновременно.
+        site_jobs = dict()
+        for job in jobs:
+            try:
+                site_jobs.setdefault(create_grid(job).cache_key(), job)
+            except (OSError, ValueError):
+                pass
+        pool.map(_prepare_grid, list(site_jobs.values()))
+
+        for result in pool.imap_unordered(solve_job, jobs):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное решение задач построения дорожной сети.")
+    parser.add_argument("manifest", type=Path, help="Файл задач в формате JSON lines.")
+    parser.add_argument("-o", "--output", type=Path, help="Файл результатов. По умолчанию - стандартный вывод.")
+    parser.add_argument("-j", "--n-workers", type=int, help="Число процессов.")
+    parser.add_argument("--timeout", type=float, help="Ограничение времени на задачу в секундах.")
+    parser.add_argument("--grid-cache-dir", type=Path, help="Каталог кэша сеток.")
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout if args.output is None else stack.enter_context(open(args.output, "w"))
+        solve(jobs, output, n_workers=args.n_workers, timeout=args.timeout, grid_cache_dir=args.grid_cache_dir)
+
+
+if __name__ == "__main__":
+    main()
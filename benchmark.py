@@ -0,0 +1,301 @@
+"""
+Замеры производительности этапов построения дорожной сети на синтетических задачах.
+
+Для каждого генератора и размера задачи отдельно измеряются время и пиковый объем памяти этапов: генерация сетки
+(Grid.generate), выбор точек Штейнера (NetworkBuilder), построение MST (NetworkBuilder._build_mst), разбиение ребер
+(EdgesSplitter.calculate) и подсчет стоимости. Время - лучшее из нескольких повторов, память измеряется в отдельном
+прогоне с tracemalloc, чтобы не искажать время. Результаты сохраняются в JSON и могут быть сравнены с результатами
+другого коммита.
+
+Запуск:
+    python benchmark.py --generators uniform clustered corridor --sizes 10 30 100 -o results.json
+    python benchmark.py --sizes 30 --set GRID_SIZE=500 --set N_BATCH_STEINER_POINTS=4 --compare results.json
+"""
+
+import argparse
+import ast
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import configs
+import utils
+from edges_splitter import EdgesSplitter
+from grid import Grid
+from network_builder import NetworkBuilder
+
+STAGES = ("grid", "steiner_points", "mst", "splitter", "cost")
+
+
+def generate_uniform(n_points: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Точки, равномерно распределенные в квадрате. Сторона квадрата растет как корень из числа точек, поэтому
+    плотность точек не зависит от их числа.
+
+    :param n_points:
+    :param random_state:
+    :return:
+    """
+    extent = np.sqrt(n_points)
+
+    return random_state.uniform(0, extent, size=(n_points, 2))
+
+
+def generate_clustered(n_points: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Точки, сгруппированные в кластеры примерно по 20 точек с нормальным распределением вокруг центров.
+
+    :param n_points:
+    :param random_state:
+    :return:
+    """
+    extent = np.sqrt(n_points)
+    n_clusters = max(1, n_points // 20)
+
+    centers = random_state.uniform(0, extent, size=(n_clusters, 2))
+    scale = extent / (4 * np.sqrt(n_clusters))
+
+    return centers[random_state.randint(n_clusters, size=n_points)] + random_state.normal(0, scale, size=(n_points, 2))
+
+
+def generate_corridor(n_points: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Точки вдоль длинного узкого коридора, например трассы дороги.
+
+    :param n_points:
+    :param random_state:
+    :return:
+    """
+    x = random_state.uniform(0, n_points, size=n_points)
+    y = random_state.normal(0, 1, size=n_points)
+
+    return np.column_stack((x, y))
+
+
+GENERATORS = {
+    "uniform": generate_uniform,
+    "clustered": generate_clustered,
+    "corridor": generate_corridor,
+}
+
+
+def generate_instance(generator: str, n_terminals: int, n_quarries: int, seed: int):
+    """
+    Синтетическая задача: терминальные точки и карьеры, полученные одним генератором.
+
+    :param generator: Имя генератора из GENERATORS.
+    :param n_terminals:
+    :param n_quarries:
+    :param seed:
+    :return: Все точки (сначала терминальные, затем карьеры) и индексы карьеров.
+    """
+    random_state = np.random.RandomState(seed)
+    points = GENERATORS[generator](n_terminals + n_quarries, random_state)
+
+    return points, set(range(n_terminals, n_terminals + n_quarries))
+
+
+def run_pipeline(points: np.ndarray, quarries_indices: set, seed: int, capacity: float):
+    """
+    Однократное выполнение всех этапов.
+
+    :param points:
+    :param quarries_indices:
+    :param seed:
+    :param capacity: Объем каждого карьера.
+    :return: Словарь этапов со временем выполнения, итоговая стоимость и число точек сетки.
+    """
+    times = dict()
+
+    def timed(stage, function):
+        start_time = time.perf_counter()
+        value = function()
+        times[stage] = time.perf_counter() - start_time
+        return value
+
+    grid = Grid(points, quarries_indices, seed=seed, quarry_capacities={ind: capacity for ind in quarries_indices})
+    timed("grid", grid.generate)
+    network_builder = timed("steiner_points", lambda: NetworkBuilder(grid, n_workers=1))
+    mst, _ = timed("mst", network_builder._build_mst)
+
+    splitter = EdgesSplitter(grid.create_network(mst), keep_old_road_network=False)
+    timed("splitter", splitter.calculate)
+    cost = timed("cost", lambda: utils.compute_road_network_cost(splitter.road_network))
+
+    return times, cost, grid.points.shape[0]
+
+
+def measure_peak_memory(points: np.ndarray, quarries_indices: set, seed: int, capacity: float):
+    """
+    Пиковый объем памяти, выделенной на каждом этапе, по данным tracemalloc.
+
+    :param points:
+    :param quarries_indices:
+    :param seed:
+    :param capacity:
+    :return: Словарь этапов с пиковым объемом памяти в байтах.
+    """
+    peaks = dict()
+
+    def traced(stage, function):
+        tracemalloc.reset_peak()
+        start_memory, _ = tracemalloc.get_traced_memory()
+        value = function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        peaks[stage] = peak_memory - start_memory
+        return value
+
+    tracemalloc.start()
+    try:
+        grid = Grid(points, quarries_indices, seed=seed, quarry_capacities={ind: capacity for ind in quarries_indices})
+        traced("grid", grid.generate)
+        network_builder = traced("steiner_points", lambda: NetworkBuilder(grid, n_workers=1))
+        mst, _ = traced("mst", network_builder._build_mst)
+
+        splitter = EdgesSplitter(grid.create_network(mst), keep_old_road_network=False)
+        traced("splitter", splitter.calculate)
+        traced("cost", lambda: utils.compute_road_network_cost(splitter.road_network))
+    finally:
+        tracemalloc.stop()
+
+    return peaks
+
+
+def run_benchmark(generator: str, n_terminals: int, n_quarries: int, seed: int, capacity: float, n_repeats: int,
+                  trace_memory: bool) -> dict:
+    """
+    Замер одной задачи.
+
+    :param generator:
+    :param n_terminals:
+    :param n_quarries:
+    :param seed:
+    :param capacity:
+    :param n_repeats: Число повторов для замера времени. Сохраняется лучшее время каждого этапа.
+    :param trace_memory: Замерять ли пиковый объем памяти.
+    :return:
+    """
+    points, quarries_indices = generate_instance(generator, n_terminals, n_quarries, seed)
+
+    result = {"generator": generator, "n_terminals": n_terminals, "n_quarries": n_quarries, "seed": seed}
+    try:
+        runs = [run_pipeline(points, quarries_indices, seed, capacity) for _ in range(n_repeats)]
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+
+    result["cost"] = runs[0][1]
+    result["n_grid_points"] = runs[0][2]
+    result["stages"] = {stage: {"time": min(times[stage] for times, _, _ in runs)} for stage in STAGES}
+    result["total_time"] = sum(stage["time"] for stage in result["stages"].values())
+
+    if trace_memory:
+        for stage, peak_memory in measure_peak_memory(points, quarries_indices, seed, capacity).items():
+            result["stages"][stage]["peak_memory"] = peak_memory
+
+    return result
+
+
+def get_environment() -> dict:
+    """
+    Описание окружения замера: коммит, версии Python и numpy, параметры configs.
+
+    :return:
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    parameters = {name: getattr(configs, name) for name in dir(configs) if name.isupper()}
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "configs": {name: value for name, value in parameters.items() if isinstance(value, (int, float, str, bool, type(None)))},
+    }
+
+
+def compare(results: list, baseline: dict):
+    """
+    Вывод отношения времени этапов к времени из сохраненных результатов. Значения больше 1 - замедление.
+
+    :param results:
+    :param baseline: Результаты другого запуска benchmark.py.
+    :return:
+    """
+
+    def key(result):
+        return result["generator"], result["n_terminals"], result["n_quarries"], result["seed"]
+
+    baseline_results = {key(result): result for result in baseline["results"] if "stages" in result}
+    print(f"Сравнение с {baseline['environment'].get('commit')}:")
+    for result in results:
+        baseline_result = baseline_results.get(key(result))
+        if baseline_result is None or "stages" not in result:
+            continue
+
+        ratios = ", ".join(f"{stage}: {result['stages'][stage]['time'] / baseline_result['stages'][stage]['time']:.2f}"
+                           for stage in STAGES if baseline_result["stages"][stage]["time"] > 0)
+        print(f"  {result['generator']} {result['n_terminals']}: {ratios}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности этапов построения дорожной сети.")
+    parser.add_argument("--generators", nargs="+", choices=list(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 30, 100], help="Числа терминальных точек.")
+    parser.add_argument("--quarries-fraction", type=float, default=0.1,
+                        help="Доля карьеров от числа терминальных точек, но не менее двух.")
+    parser.add_argument("--capacity", type=float, default=1e9, help="Объем каждого карьера.")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--repeats", type=int, default=3, help="Число повторов для замера времени.")
+    parser.add_argument("--no-memory", action="store_true", help="Не замерять пиковый объем памяти.")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Изменение параметра configs, например GRID_SIZE=500.")
+    parser.add_argument("-o", "--output", type=Path, help="Файл для сохранения результатов в JSON.")
+    parser.add_argument("--compare", type=Path, help="Файл результатов для сравнения времени этапов.")
+    args = parser.parse_args()
+
+    # Без кэша сеток замеряется генерация сетки, а не ее загрузка. Кэш можно включить через --set.
+    configs.GRID_CACHE_DIR = None
+    for assignment in args.set:
+        name, value = assignment.split("=", maxsplit=1)
+        if not hasattr(configs, name):
+            raise ValueError(f"Неизвестный параметр {name}.")
+        setattr(configs, name, ast.literal_eval(value))
+
+    results = list()
+    for generator in args.generators:
+        for n_terminals in args.sizes:
+            n_quarries = max(2, int(round(args.quarries_fraction * n_terminals)))
+            for seed in args.seeds:
+                result = run_benchmark(generator, n_terminals, n_quarries, seed, args.capacity, args.repeats,
+                                       not args.no_memory)
+                results.append(result)
+
+                stages = ", ".join(f"{stage}: {value['time']:.3f} с" for stage, value in result.get("stages", {}).items())
+                print(f"{generator} {n_terminals} (seed {seed}): {stages or result.get('error')}", file=sys.stderr)
+
+    report = {"environment": get_environment(), "results": results}
+    if args.output is None:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Оценка точек Штейнера относительно текущего графа.
+"""
+
+from collections import defaultdict
+from typing import Dict
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra, minimum_spanning_tree
+
+import configs
+import instrumentation
+import utils
+from edges_splitter import EdgesSplitter
+from graph import CompleteGraph
+from graph import minimum_spanning_tree as graph_minimum_spanning_tree
+from grid import Grid
+from network import Network
+from utils import edge_key
+
+
+class CandidateEvaluator:
+    """
+    Оценка точек Штейнера для фиксированного графа.
+
+    Точка добавляется в граф на месте и удаляется после оценки. Если в исходном графе ни один карьер не был опустошен,
+    разбиение пересчитывается только для ребер, у концов которых изменились расстояния до карьеров. Если при этом
+    какой-либо карьер опустошается, выполняется полный пересчет.
+
+    Для отсечения заведомо неудачных точек используется нижняя оценка стоимости MST (lower_bound).
+
+    Длины и стоимости ребер хранятся в плотных матрицах в порядке ordered_vertices, MST строится scipy.
+    """
+
+    @instrumentation.timed()
+    def __init__(self, grid: Grid, graph: CompleteGraph):
+
+        self.grid = grid
+        self.graph = graph
+        self.vertices = frozenset(graph.nodes)
+        self.ordered_vertices = np.array(graph.nodes, dtype=np.int64)
+        self.positions = {vertex: position for position, vertex in enumerate(self.ordered_vertices.tolist())}
+
+        network = self.grid.create_network(self.graph)
+        self.capacities = dict(network.quarries_capacities)
+
+        # Ломаные исходных ребер создаются только для ребер, затронутых при инкрементальной оценке.
+        edge_ids = network.alive_edges()
+        self.edge_lines = network.edge_lines.copy()
+        self.incidence = {edge_key(u, v): (u, v, edge_id) for u, v, edge_id in zip(
+            network.edge_first[edge_ids].tolist(), network.edge_last[edge_ids].tolist(), edge_ids.tolist())}
+        self.length_matrix = self._to_matrix(
+            dict(zip(self.incidence, network.edge_length[edge_ids].tolist())), self.positions)
+
+        splitter = EdgesSplitter(network, keep_old_road_network=False)
+        splitter.calculate()
+
+        self.costs = dict(utils.compute_quarries_costs(network))
+        self.volumes = self._compute_quarries_volumes(network)
+        self.distances = {vertex: dict(network.distances_to_quarries[vertex]) for vertex in self.graph.nodes}
+        self.quarry_distance_matrix = np.array(
+            [[self.distances[vertex][quarry] for quarry in self.capacities] for vertex in self.ordered_vertices.tolist()])
+
+        self.is_incremental = configs.INCREMENTAL_EVALUATION and not any(
+            np.isclose(capacity, 0) for capacity in network.quarries_capacities.values())
+
+        self.cost_matrix = self._to_matrix(self.costs, self.positions)
+        with instrumentation.timer("minimum_spanning_tree"):
+            self.mst, self.cost = graph_minimum_spanning_tree(self.ordered_vertices, self.cost_matrix)
+
+        self.quarries_distances = self._compute_nearest_quarry_distances(self.ordered_vertices)
+        lengths = np.vstack([self.grid.distance_matrix[vertex][self.ordered_vertices] for vertex in self.ordered_vertices])
+        self.lower_bound_weights = utils.compute_lines_costs_lower_bound(
+            lengths, self.quarries_distances.reshape(-1, 1), self.quarries_distances.reshape(1, -1))
+        self.lower_bounds = dict()
+
+    @instrumentation.timed()
+    def lower_bound(self, steiner_point_ind: int) -> float:
+        """
+        Нижняя оценка стоимости MST графа, дополненного точкой Штейнера.
+
+        Стоимость каждого ребра оценивается снизу по длине кратчайшего пути на сетке и расстояниям от его концов до
+        ближайшего карьера на сетке. MST по оценкам ребер не дороже MST по их настоящим стоимостям. Оценки
+        запоминаются, так как граф оценщика не меняется.
+
+        :param steiner_point_ind:
+        :return:
+        """
+
+        lower_bound = self.lower_bounds.get(steiner_point_ind)
+        if lower_bound is not None:
+            return lower_bound
+
+        n_vertices = len(self.ordered_vertices)
+        steiner_quarry_distance = self._compute_nearest_quarry_distances(np.array([steiner_point_ind]))
+
+        weights = np.zeros((n_vertices + 1, n_vertices + 1))
+        weights[:n_vertices, :n_vertices] = self.lower_bound_weights
+        weights[n_vertices, :n_vertices] = utils.compute_lines_costs_lower_bound(
+            self.grid.distance_matrix[steiner_point_ind][self.ordered_vertices], steiner_quarry_distance, self.quarries_distances)
+
+        lower_bound = minimum_spanning_tree(weights).sum()
+        self.lower_bounds[steiner_point_ind] = lower_bound
+
+        return lower_bound
+
+    def _compute_nearest_quarry_distances(self, vertices: np.ndarray) -> np.ndarray:
+        """
+        Расстояния на сетке от вершин до ближайшего карьера.
+
+        :param vertices:
+        :return:
+        """
+
+        return np.min(np.vstack([self.grid.distance_matrix[quarry][vertices] for quarry in self.capacities]), axis=0)
+
+    @instrumentation.timed()
+    def evaluate(self, steiner_point_ind: int):
+        """
+        Стоимость MST графа, дополненного точкой Штейнера. Граф возвращается в исходное состояние.
+
+        :param steiner_point_ind:
+        :return: Стоимость и MST. Если объема карьеров не хватает для построения сети с этой точкой, стоимость
+        бесконечна, а MST равен None.
+        """
+
+        self.graph.add_node(steiner_point_ind)
+        try:
+            costs = None
+            if self.is_incremental:
+                costs = self._compute_costs_incrementally(steiner_point_ind)
+                if costs is not None:
+                    instrumentation.count("CandidateEvaluator.incremental_evaluations")
+            if costs is None:
+                instrumentation.count("CandidateEvaluator.full_evaluations")
+                try:
+                    costs = self._compute_costs()
+                except ValueError:
+                    return np.inf, None
+
+            vertices = np.append(self.ordered_vertices, steiner_point_ind)
+            positions = dict(self.positions)
+            positions[steiner_point_ind] = len(self.ordered_vertices)
+            cost_matrix = self._to_matrix(costs, positions, self.cost_matrix)
+
+            with instrumentation.timer("minimum_spanning_tree"):
+                mst, cost = graph_minimum_spanning_tree(vertices, cost_matrix)
+
+            return cost, mst
+        finally:
+            self.graph.remove_node(steiner_point_ind)
+
+    @instrumentation.timed()
+    def _compute_costs(self):
+        """
+        Полный пересчет стоимостей ребер.
+
+        :return:
+        """
+
+        network = self.grid.create_network(self.graph)
+        splitter = EdgesSplitter(network, keep_old_road_network=False)
+        splitter.calculate()
+
+        return utils.compute_quarries_costs(network)
+
+    @instrumentation.timed()
+    def _compute_costs_incrementally(self, steiner_point_ind: int):
+        """
+        Пересчет стоимостей только для ребер, затронутых добавлением точки Штейнера.
+
+        :param steiner_point_ind:
+        :return: Стоимости затронутых ребер или None, если требуется полный пересчет.
+        """
+
+        n_vertices = len(self.ordered_vertices)
+        vertices = np.append(self.ordered_vertices, steiner_point_ind)
+        positions = dict(self.positions)
+        positions[steiner_point_ind] = n_vertices
+
+        lengths = {edge_key(steiner_point_ind, ind): self.grid.path_length(steiner_point_ind, ind)
+                   for ind in self.graph.neighbors(steiner_point_ind)}
+        length_matrix = self._to_matrix(lengths, positions, self.length_matrix)
+
+        quarry_positions = [positions[quarry] for quarry in self.capacities]
+        quarry_distance_matrix = dijkstra(length_matrix, directed=False, indices=quarry_positions).T
+
+        is_affected = np.ones(n_vertices + 1, dtype=bool)
+        is_affected[:n_vertices] = np.any(quarry_distance_matrix[:n_vertices] != self.quarry_distance_matrix, axis=1)
+        affected_vertices = set(vertices[is_affected].tolist())
+
+        rows, columns = np.triu_indices(n_vertices + 1, k=1)
+        mask = (is_affected[rows] | is_affected[columns]) & (length_matrix[rows, columns] != 0)
+        affected_edges = list(zip(vertices[rows[mask]].tolist(), vertices[columns[mask]].tolist()))
+
+        capacities = dict(self.capacities)
+        for key, volumes in self.volumes.items():
+            if affected_vertices.isdisjoint(key):
+                for quarry, volume in volumes.items():
+                    capacities[quarry] -= volume
+
+        if any(capacity < 0 or np.isclose(capacity, 0) for capacity in capacities.values()):
+            return None
+
+        incidence_list = list()
+        for u, v in affected_edges:
+            key = edge_key(u, v)
+            if key in self.incidence:
+                first, last, edge_id = self.incidence[key]
+                incidence_list.append((first, last, self.edge_lines[edge_id]))
+            else:
+                incidence_list.append((u, v, self.grid.reconstruct_path(u, v)))
+        network = Network(vertices=list(self.graph.nodes), quarry_capacities=capacities, incidence_list=incidence_list)
+        network.distances_to_quarries.update({
+            vertex: dict(zip(self.capacities, distances))
+            for vertex, distances in zip(vertices.tolist(), quarry_distance_matrix.tolist())})
+
+        try:
+            EdgesSplitter(network, keep_old_road_network=False).calculate(compute_distances=False)
+        except ValueError:
+            return None
+
+        if any(np.isclose(capacity, 0) for capacity in network.quarries_capacities.values()):
+            return None
+
+        return utils.compute_quarries_costs(network)
+
+    @staticmethod
+    def _to_matrix(values: Dict, positions: Dict[int, int], matrix: np.ndarray = None) -> np.ndarray:
+        """
+        Симметричная матрица значений ребер. Отсутствующие ребра имеют значение 0.
+
+        :param values: Значения ребер с ключами edge_key(u, v).
+        :param positions: Номера строк вершин.
+        :param matrix: Матрица, значения которой копируются в левый верхний угол результата.
+        :return:
+        """
+
+        n_vertices = len(positions)
+        result = np.zeros((n_vertices, n_vertices))
+        if matrix is not None:
+            result[:matrix.shape[0], :matrix.shape[1]] = matrix
+
+        if values:
+            rows, columns = np.array([[positions[vertex] for vertex in key] for key in values], dtype=np.int64).T
+            data = np.fromiter(values.values(), dtype=np.float64, count=len(values))
+            result[rows, columns] = data
+            result[columns, rows] = data
+
+        return result
+
+    @staticmethod
+    def _compute_quarries_volumes(network: Network):
+        """
+        Объем материалов, взятый из каждого карьера для каждого исходного ребра.
+
+        :param network:
+        :return:
+        """
+
+        volumes = defaultdict(lambda: defaultdict(lambda: 0))
+        for key, line in network.edge_to_line_mapping.items():
+            volumes[network.original_edge[key]][network.edge_attached_quarry[key]] += utils.compute_required_volume(line)
+
+        return {key: dict(quarries_volumes) for key, quarries_volumes in volumes.items()}
@@ -5,8 +5,32 @@
 ROAD_WIDTH = 1
 ROAD_HEIGHT = 1
 UNIT_COST = 1
+QUARRY_CAPACITY = 1e2
 
 GRID_SIZE = 2000
+GRID_SAMPLING = "uniform"
+GRID_COARSE_SIZE = 300
+GRID_REFINEMENT_LEVELS = 5
+GRID_POINTS_PER_LEVEL = 20
+GRID_REFINEMENT_RADIUS = 0.2
+GRID_SEED = None
+GRID_CACHE_DIR = None
 N_GRID_NEIGHBOURS = 6
+SPARSE_GRID = True
+ALL_PAIRS_SHORTEST_PATHS = False
+PATH_CACHE_SIZE = 100000
 BOUNDARY_INDENT = 1
 N_STEINER_POINTS = 20
+STEINER_POINTS_GENERATOR = "lattice"
+N_STEINER_CANDIDATES = 20
+N_REFINED_STEINER_CANDIDATES = 5
+N_WORKERS = 1
+N_DISTANCE_WORKERS = 1
+INCREMENTAL_EVALUATION = True
+PRUNE_CANDIDATES = True
+N_BATCH_STEINER_POINTS = 1
+BATCH_JOB_TIMEOUT = None
+BATCH_GRID_CACHE_SIZE = 4
+INSTRUMENTATION = False
+BUILDER_TIME_BUDGET = None
+MEMOIZE_CANDIDATES = False
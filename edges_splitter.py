@@ -3,12 +3,10 @@
 
 """Класс, отвечающий за разбиение ребер дорожной сети в зависимости от расположения карьеров."""
 
-from copy import deepcopy
-
 import numpy as np
 
+import instrumentation
 import utils
-from utils import edge_key
 from network import Network
 
 
@@ -17,37 +15,67 @@ class EdgesSplitter:
     Класс, отвечающий за разбиение ребер дорожной сети в зависимости от расположения карьеров.
     """
 
-    def __init__(self, road_network: Network):
+    def __init__(self, road_network: Network, keep_old_road_network: bool = True):
+        """
+
+        :param road_network:
+        :param keep_old_road_network: Сохранять ли копию сети до разбиения в old_road_network. Копия разделяет
+        геометрию с исходной сетью.
+        """
 
         self.road_network = road_network
-        self.old_road_network = deepcopy(road_network)
+        self.old_road_network = road_network.copy() if keep_old_road_network else None
 
-    def calculate(self):
+    @instrumentation.timed()
+    def calculate(self, compute_distances: bool = True):
         # language=rst
         """
         Расчет карьеров
 
+        :param compute_distances: Если False, используются уже заданные расстояния до карьеров.
         :return:
         """
 
-        self.road_network.compute_distances_to_quarries()
+        if compute_distances:
+            self.road_network.compute_distances_to_quarries()
 
         for u, v in self.road_network.traverse_edges_by_increasing_distance_to_quarry():
-            self._construct_edge(u, v)
+            self._construct_edge_parts(u, v)
+
+    def _construct_edge_parts(self, u: int, v: int):
+        """
+        Строительство ребра и всех частей, полученных при его разбиении.
+
+        Части обрабатываются с помощью стека в том же порядке, что и при рекурсивном обходе: сначала часть, ближняя
+        к карьеру, затем дальняя. Поэтому все разбиения одного исходного ребра выполняются подряд, а глубина стека
+        вызовов не зависит от числа разбиений.
+
+        :param u:
+        :param v:
+        :return:
+        """
+
+        edges_stack = [(u, v)]
+        while edges_stack:
+            parts = self._construct_edge(*edges_stack.pop())
+            edges_stack.extend(reversed(parts))
 
     def _construct_edge(self, u: int, v: int):
         """
         Строительство ребра
 
         :param linear:
-        :return:
+        :return: Части ребра, которые необходимо построить после разбиения, в порядке обработки.
         """
 
-        start_vertex = self.road_network.first_poit_vertex[edge_key(u, v)]
-        end_vertex = self.road_network.last_point_vertex[edge_key(u, v)]
+        network = self.road_network
 
-        start_nearest_quarry = self.road_network.find_nearest_not_empty_quarry(start_vertex)
-        end_nearest_quarry = self.road_network.find_nearest_not_empty_quarry(end_vertex)
+        edge_id = network.edge_id(u, v)
+        start_vertex = int(network.edge_first[edge_id])
+        end_vertex = int(network.edge_last[edge_id])
+
+        start_nearest_quarry = network.find_nearest_not_empty_quarry(start_vertex)
+        end_nearest_quarry = network.find_nearest_not_empty_quarry(end_vertex)
 
         # Для одной из вершин все доступные карьеры опустошены
         if start_nearest_quarry is None or end_nearest_quarry is None:
@@ -55,50 +83,49 @@ class EdgesSplitter:
 
         # Вершина start всегда ближайшая к карьеру
         were_vertices_inverted = False
-        if (self.road_network.distances_to_quarries[start_vertex][start_nearest_quarry] >
-                self.road_network.distances_to_quarries[end_vertex][end_nearest_quarry]):
+        if network.distance(start_vertex, start_nearest_quarry) > network.distance(end_vertex, end_nearest_quarry):
             start_vertex, end_vertex = end_vertex, start_vertex
             start_nearest_quarry, end_nearest_quarry = end_nearest_quarry, start_nearest_quarry
             were_vertices_inverted = True
 
         # Если расстояния от дальнего конца ребра до ближайшего карьера ближнего конца почти совпадает с растоянием от
         # дальнего конца ребра до его собственного ближайшего карьера, то выбираем ближайший карьер ближнего конца.
-        if np.isclose(self.road_network.distances_to_quarries[end_vertex][start_nearest_quarry],
-                      self.road_network.distances_to_quarries[end_vertex][end_nearest_quarry]):
+        if np.isclose(network.distance(end_vertex, start_nearest_quarry), network.distance(end_vertex, end_nearest_quarry)):
             end_nearest_quarry = start_nearest_quarry
 
-        length = self.road_network.edge_to_line_mapping[edge_key(start_vertex, end_vertex)].length
+        length = network.edge_length[edge_id]
 
         # Если ближайшие карьеры двух концов ребер не совпали, или совпали, но пути, ведущие к карьеру отличаются,
         # то необходимо разбить ребро на части
         if start_nearest_quarry != end_nearest_quarry or \
-                not np.isclose(self.road_network.distances_to_quarries[end_vertex][end_nearest_quarry],
-                               self.road_network.distances_to_quarries[start_vertex][start_nearest_quarry] + length):
+                not np.isclose(network.distance(end_vertex, end_nearest_quarry),
+                               network.distance(start_vertex, start_nearest_quarry) + length):
 
-            path_difference = (self.road_network.distances_to_quarries[end_vertex][end_nearest_quarry] -
-                               self.road_network.distances_to_quarries[start_vertex][start_nearest_quarry])
+            path_difference = network.distance(end_vertex, end_nearest_quarry) - network.distance(start_vertex, start_nearest_quarry)
             new_length = (length + path_difference) / 2
 
-            start_vertex, new_vertex, end_vertex = self.road_network.split_edge(start_vertex, end_vertex, new_length, from_end=were_vertices_inverted)
+            start_vertex, new_vertex, end_vertex = network.split_edge(start_vertex, end_vertex, new_length, from_end=were_vertices_inverted)
 
-            self._construct_edge(start_vertex, new_vertex)
-            self._construct_edge(new_vertex, end_vertex)
+            return [(start_vertex, new_vertex), (new_vertex, end_vertex)]
 
         else:
-            line = self.road_network.edge_to_line_mapping[edge_key(start_vertex, end_vertex)]
+            line = network.edge_lines[edge_id]
             nearest_quarry = start_nearest_quarry
             required_volume = utils.compute_required_volume(line)
 
-            if (required_volume < self.road_network.quarries_capacities[nearest_quarry] or
-                    np.isclose(required_volume, self.road_network.quarries_capacities[nearest_quarry])):
-                self.road_network.quarries_capacities[nearest_quarry] -= required_volume
-                self.road_network.edge_attached_quarry[edge_key(start_vertex, end_vertex)] = nearest_quarry
+            if (required_volume < network.quarries_capacities[nearest_quarry] or
+                    np.isclose(required_volume, network.quarries_capacities[nearest_quarry])):
+                network.consume_quarry(nearest_quarry, required_volume)
+                network.edge_quarry[edge_id] = nearest_quarry
+
+                return []
             else:
-                new_edge_length = utils.find_max_road_length(self.road_network.quarries_capacities[nearest_quarry])
-                start_vertex, new_vertex, end_vertex = self.road_network.split_edge(start_vertex, end_vertex, new_edge_length, from_end=were_vertices_inverted)
+                new_edge_length = utils.find_max_road_length(network.quarries_capacities[nearest_quarry])
+                start_vertex, new_vertex, end_vertex = network.split_edge(start_vertex, end_vertex, new_edge_length, from_end=were_vertices_inverted)
+
+                network.empty_quarry(nearest_quarry)
 
-                self.road_network.quarries_capacities[nearest_quarry] = 0
+                network.edge_quarry[network.edge_id(start_vertex, new_vertex)] = nearest_quarry
 
-                self.road_network.edge_attached_quarry[edge_key(start_vertex, new_vertex)] = nearest_quarry
-                self._construct_edge(new_vertex, end_vertex)
+                return [(new_vertex, end_vertex)]
 
@@ -0,0 +1,205 @@
+"""
+Компактные графы для построения дорожной сети.
+"""
+
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse.csgraph import minimum_spanning_tree as scipy_minimum_spanning_tree
+
+
+class Graph:
+    """
+    Неориентированный граф без атрибутов. Для каждой вершины хранится словарь соседей, значения которого -
+    идентификаторы ребер.
+
+    Порядок обхода вершин и ребер совпадает с порядком networkx.Graph: вершины - в порядке добавления, ребра - по
+    вершинам в порядке добавления, каждое ребро один раз.
+    """
+
+    def __init__(self, nodes: Iterable[int] = (), edges: Iterable[Tuple[int, int]] = ()):
+
+        self._adjacency = dict()
+        for node in nodes:
+            self.add_node(node)
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    @property
+    def nodes(self):
+        return self._adjacency.keys()
+
+    @property
+    def edges(self) -> List[Tuple[int, int]]:
+        edges = list()
+        seen = set()
+        for u, neighbours in self._adjacency.items():
+            for v in neighbours:
+                if v not in seen:
+                    edges.append((u, v))
+            seen.add(u)
+
+        return edges
+
+    def __contains__(self, node) -> bool:
+        return node in self._adjacency
+
+    def __iter__(self):
+        return iter(self._adjacency)
+
+    def __len__(self):
+        return len(self._adjacency)
+
+    def add_node(self, node: int):
+        if node not in self._adjacency:
+            self._adjacency[node] = dict()
+
+    def add_edge(self, u: int, v: int, edge_id: int = None):
+        """
+        Добавление ребра. Отсутствующие вершины добавляются.
+
+        :param u:
+        :param v:
+        :param edge_id: Идентификатор ребра.
+        :return:
+        """
+        self.add_node(u)
+        self.add_node(v)
+        self._adjacency[u][v] = edge_id
+        self._adjacency[v][u] = edge_id
+
+    def add_edges_from(self, edges: Iterable[Tuple[int, int, int]]):
+        """
+        Добавление ребер, заданных тройками (u, v, идентификатор ребра).
+
+        :param edges:
+        :return:
+        """
+        for u, v, edge_id in edges:
+            self.add_edge(u, v, edge_id)
+
+    def remove_edge(self, u: int, v: int):
+        del self._adjacency[u][v]
+        if u != v:
+            del self._adjacency[v][u]
+
+    def remove_node(self, node: int):
+        for neighbour in self._adjacency[node]:
+            if neighbour != node:
+                del self._adjacency[neighbour][node]
+        del self._adjacency[node]
+
+    def has_edge(self, u: int, v: int) -> bool:
+        return u in self._adjacency and v in self._adjacency[u]
+
+    def neighbors(self, node: int):
+        return iter(self._adjacency[node])
+
+    def edge_id(self, u: int, v: int) -> int:
+        return self._adjacency[u][v]
+
+    def number_of_edges(self) -> int:
+        return sum(map(len, self._adjacency.values())) // 2
+
+    def copy(self) -> "Graph":
+        graph = Graph()
+        graph._adjacency = {node: dict(neighbours) for node, neighbours in self._adjacency.items()}
+
+        return graph
+
+
+class CompleteGraph:
+    """
+    Полный граф на вершинах сетки. Хранятся только вершины, ребра соединяют все пары вершин с ненулевым расстоянием
+    на сетке и не хранятся явно.
+    """
+
+    def __init__(self, grid, nodes: Iterable[int] = ()):
+        """
+
+        :param grid: Сетка, по матрице расстояний которой определяются ребра.
+        :param nodes: Вершины сетки.
+        """
+
+        self.grid = grid
+        self._nodes = list()
+        self._node_set = set()
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[int]:
+        return list(self._nodes)
+
+    @property
+    def edges(self) -> List[Tuple[int, int]]:
+        """
+        Ребра (u, v), где u добавлена в граф раньше v.
+
+        :return:
+        """
+        nodes = np.array(self._nodes, dtype=np.int64)
+        rows, columns = np.triu_indices(len(nodes), k=1)
+        mask = ~np.isclose(self.length_matrix()[rows, columns], 0)
+
+        return list(zip(nodes[rows[mask]].tolist(), nodes[columns[mask]].tolist()))
+
+    def __contains__(self, node) -> bool:
+        return node in self._node_set
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add_node(self, node: int):
+        node = int(node)
+        if node not in self._node_set:
+            self._nodes.append(node)
+            self._node_set.add(node)
+
+    def remove_node(self, node: int):
+        self._nodes.remove(node)
+        self._node_set.remove(node)
+
+    def remove_nodes_from(self, nodes: Iterable[int]):
+        for node in nodes:
+            self.remove_node(node)
+
+    def neighbors(self, node: int):
+        distances = self.grid.distance_matrix[node][self._nodes]
+
+        return (neighbour for neighbour, distance in zip(self._nodes, distances)
+                if neighbour != node and not np.isclose(distance, 0))
+
+    def length_matrix(self) -> np.ndarray:
+        """
+        Матрица расстояний на сетке между вершинами графа в порядке nodes.
+
+        :return:
+        """
+        if not self._nodes:
+            return np.zeros((0, 0))
+
+        return np.vstack([self.grid.distance_matrix[node][self._nodes] for node in self._nodes])
+
+
+def minimum_spanning_tree(nodes: np.ndarray, weights: np.ndarray) -> Tuple[Graph, float]:
+    """
+    Минимальное остовное дерево (лес, если граф несвязный) графа, заданного плотной матрицей весов.
+
+    :param nodes: Вершины в порядке строк матрицы.
+    :param weights: Симметричная матрица весов ребер. Нулевой вес означает отсутствие ребра.
+    :return: Дерево, содержащее все вершины, и его вес.
+    """
+    tree = scipy_minimum_spanning_tree(weights).tocoo()
+
+    rows = np.minimum(tree.row, tree.col)
+    columns = np.maximum(tree.row, tree.col)
+    order = np.lexsort((columns, rows))
+
+    nodes = np.asarray(nodes)
+    edges = zip(nodes[rows[order]].tolist(), nodes[columns[order]].tolist())
+
+    return Graph(nodes.tolist(), edges), float(tree.data.sum())
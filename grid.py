@@ -1,12 +1,134 @@
+import copy
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
 import numpy as np
-import networkx as nx
+from scipy.sparse import csr_matrix
 from scipy.sparse.csgraph import dijkstra
 from scipy.spatial import Delaunay
 from shapely.geometry import LineString
 from sklearn.neighbors import KDTree
 
 import configs
+import instrumentation
+import utils
+from graph import CompleteGraph, Graph
 from network import Network
+from utils import edge_key
+
+
+class ShortestPaths:
+    """
+    Кратчайшие пути на сетке от заданного набора источников.
+
+    Строки матриц расстояний и предшественников хранятся только для источников и вычисляются по требованию,
+    поэтому память и время растут с числом источников, а не как N^2.
+    """
+
+    def __init__(self, connectivity_matrix):
+
+        self.connectivity_matrix = connectivity_matrix
+        self.distance_rows = dict()
+        self.predecessor_rows = dict()
+
+        self.distance_matrix = _RowsView(self, self.distance_rows)
+        self.predecessors = _RowsView(self, self.predecessor_rows)
+
+    @instrumentation.timed()
+    def add_sources(self, sources):
+        """
+        Вычисление строк для источников, которых еще нет в кэше. Все новые источники обрабатываются одним вызовом dijkstra.
+
+        :param sources:
+        :return:
+        """
+        new_sources = [source for source in dict.fromkeys(map(int, sources)) if source not in self.distance_rows]
+        if not new_sources:
+            return
+
+        distances, predecessors = dijkstra(self.connectivity_matrix, indices=new_sources, return_predecessors=True)
+        for source, distance_row, predecessor_row in zip(new_sources, distances, predecessors):
+            self.distance_rows[source] = distance_row
+            self.predecessor_rows[source] = predecessor_row
+
+
+class _RowsView:
+    """
+    Доступ к строкам ShortestPaths с той же индексацией, что и у матрицы: view[u] и view[u, v].
+    """
+
+    def __init__(self, shortest_paths: ShortestPaths, rows: dict):
+
+        self.shortest_paths = shortest_paths
+        self.rows = rows
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            source, target = key
+            return self._row(source)[target]
+
+        return self._row(key)
+
+    def _row(self, source):
+        source = int(source)
+        if source not in self.rows:
+            self.shortest_paths.add_sources([source])
+
+        return self.rows[source]
+
+
+# Значение по умолчанию параметра cache_dir в Grid.generate: каталог из configs.GRID_CACHE_DIR.
+_CONFIGS_CACHE_DIR = object()
+
+
+class PathCache:
+    """
+    LRU-кэш восстановленных путей сетки. Ключ - неупорядоченная пара вершин.
+    """
+
+    def __init__(self, max_size: int):
+
+        self.max_size = max_size
+        self.paths = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Сохраненное значение или None.
+
+        :param key:
+        :return:
+        """
+        value = self.paths.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.paths.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        """
+        Сохранение значения с вытеснением самого старого.
+
+        :param key:
+        :param value:
+        :return:
+        """
+        if self.max_size <= 0:
+            return
+
+        self.paths[key] = value
+        self.paths.move_to_end(key)
+        if len(self.paths) > self.max_size:
+            self.paths.popitem(last=False)
 
 
 class Grid:
@@ -14,10 +136,30 @@ class Grid:
     Класс для создания сетки на плоскости.
     """
 
-    def __init__(self, terminal_points: np.ndarray, quarries_indices: set):
+    # Параметры, от которых зависит сгенерированная сетка. Входят в ключ кэша.
+    CACHE_KEY_CONFIGS = ("GRID_SIZE", "N_GRID_NEIGHBOURS", "BOUNDARY_INDENT", "SPARSE_GRID", "ALL_PAIRS_SHORTEST_PATHS",
+                         "GRID_SAMPLING", "GRID_COARSE_SIZE", "GRID_REFINEMENT_LEVELS", "GRID_POINTS_PER_LEVEL",
+                         "GRID_REFINEMENT_RADIUS")
+
+    def __init__(self, terminal_points: np.ndarray, quarries_indices: set, seed: int = None,
+                 points_of_interest: np.ndarray = None, quarry_capacities: dict = None):
+        """
+
+        :param terminal_points:
+        :param quarries_indices:
+        :param seed: Зерно генератора точек сетки. Если не задано, используется configs.GRID_SEED, а при его отсутствии -
+        глобальный генератор numpy.
+        :param points_of_interest: Дополнительные точки, вокруг которых сгущается сетка при
+        configs.GRID_SAMPLING == "adaptive". По умолчанию - начальные 'точки Штейнера' (get_points_of_interest).
+        :param quarry_capacities: Объемы карьеров. По умолчанию у каждого карьера объем configs.QUARRY_CAPACITY.
+        """
 
         self.terminal_points = terminal_points
         self.quarries_indices = quarries_indices
+        self.quarry_capacities = {ind: configs.QUARRY_CAPACITY for ind in quarries_indices} \
+            if quarry_capacities is None else dict(quarry_capacities)
+        self.seed = configs.GRID_SEED if seed is None else seed
+        self.points_of_interest = points_of_interest
 
         self.lower_left = np.min(terminal_points, axis=0)
         self.upper_right = np.max(terminal_points, axis=0)
@@ -27,15 +169,43 @@ class Grid:
         self.connectivity_matrix = None
         self.distance_matrix = None
         self.predecessors = None
+        self.shortest_paths = None
+        self.path_cache = PathCache(configs.PATH_CACHE_SIZE)
 
-    def generate(self):
+    @instrumentation.timed()
+    def generate(self, cache_dir=_CONFIGS_CACHE_DIR):
         """
         Генерация графа сетки.
 
+        :param cache_dir: Каталог кэша сеток. Если в нем есть сетка с тем же ключом (cache_key), она загружается вместо
+        генерации, иначе сгенерированная сетка сохраняется туда. Если не задан, используется configs.GRID_CACHE_DIR.
+        None отключает кэш.
         :return:
         """
-        indent = np.array((configs.BOUNDARY_INDENT, configs.BOUNDARY_INDENT))
-        self.points = np.random.uniform(self.lower_left - indent, self.upper_right + indent, size=(configs.GRID_SIZE, 2))
+        if cache_dir is _CONFIGS_CACHE_DIR:
+            cache_dir = configs.GRID_CACHE_DIR
+        if cache_dir is not None:
+            path = Path(cache_dir) / self.cache_key()
+            if path.is_dir():
+                self.load(path)
+                return
+
+        self._generate()
+
+        if cache_dir is not None:
+            self.save(path)
+
+    def _generate(self):
+        """
+        Генерация точек сетки, триангуляции и кратчайших путей от терминальных вершин.
+
+        :return:
+        """
+        random_state = np.random if self.seed is None else np.random.RandomState(self.seed)
+        if configs.GRID_SAMPLING == "adaptive":
+            self.points = self._sample_adaptive_points(random_state)
+        else:
+            self.points = self._sample_uniform_points(random_state, configs.GRID_SIZE)
         self.points = np.vstack((self.terminal_points, self.points))
 
         self.kd_tree = KDTree(self.points)
@@ -46,16 +216,225 @@ class Grid:
         #     self.connectivity_matrix[ind, neighbours] = dists
         #
         # self.connectivity_matrix = np.max(np.dstack((self.connectivity_matrix, self.connectivity_matrix.T)), axis=2)
+        self.connectivity_matrix = self._build_connectivity_matrix()
+
+        if configs.ALL_PAIRS_SHORTEST_PATHS:
+            with instrumentation.timer("Grid.all_pairs_dijkstra"):
+                self.distance_matrix, self.predecessors = dijkstra(self.connectivity_matrix, return_predecessors=True)
+        else:
+            self.shortest_paths = ShortestPaths(self.connectivity_matrix)
+            self.shortest_paths.add_sources(range(len(self.terminal_points)))
+            self.distance_matrix = self.shortest_paths.distance_matrix
+            self.predecessors = self.shortest_paths.predecessors
+
+    def _sample_uniform_points(self, random_state, n_points: int) -> np.ndarray:
+        """
+        Точки, равномерно распределенные в ограничивающем прямоугольнике с отступом.
+
+        :param random_state:
+        :param n_points:
+        :return:
+        """
+        indent = np.array((configs.BOUNDARY_INDENT, configs.BOUNDARY_INDENT))
+
+        return random_state.uniform(self.lower_left - indent, self.upper_right + indent, size=(n_points, 2))
+
+    def _sample_adaptive_points(self, random_state) -> np.ndarray:
+        """
+        Многоуровневая сетка: редкие равномерные точки по всему прямоугольнику и сгущения вокруг точек интереса
+        (get_points_of_interest).
+
+        Уровень k - configs.GRID_POINTS_PER_LEVEL точек в круге радиуса R / 2^k вокруг каждой точки интереса, где R -
+        доля configs.GRID_REFINEMENT_RADIUS диагонали прямоугольника. Поэтому шаг сетки растет пропорционально
+        расстоянию до ближайшей точки интереса. Точки, попавшие за пределы прямоугольника, генерируются заново; точки
+        интереса вне прямоугольника переносятся на его границу.
+
+        Общее число точек не превышает configs.GRID_SIZE: если сгущений слишком много, из них случайно выбирается
+        нужное число точек, и плотность уменьшается равномерно.
+
+        :param random_state:
+        :return:
+        """
+        indent = np.array((configs.BOUNDARY_INDENT, configs.BOUNDARY_INDENT))
+        lower_left, upper_right = self.lower_left - indent, self.upper_right + indent
+
+        # Центры за пределами прямоугольника переносятся на его границу, иначе точки сгущения вокруг них могут не
+        # попадать в прямоугольник.
+        centers = np.clip(np.vstack((self.terminal_points, self.get_points_of_interest())), lower_left, upper_right)
+
+        radius = configs.GRID_REFINEMENT_RADIUS * np.linalg.norm(upper_right - lower_left)
+        radii = radius / 2 ** np.arange(configs.GRID_REFINEMENT_LEVELS)
+
+        n_points = configs.GRID_POINTS_PER_LEVEL * len(radii)
+        center_ids = np.repeat(np.arange(len(centers)), n_points)
+        point_radii = np.tile(np.repeat(radii, configs.GRID_POINTS_PER_LEVEL), len(centers))
+
+        refined_points = np.empty((len(center_ids), 2))
+        is_outside = np.ones(len(center_ids), dtype=bool)
+        while np.any(is_outside):
+            n_outside = np.count_nonzero(is_outside)
+            distances = point_radii[is_outside] * np.sqrt(random_state.uniform(size=n_outside))
+            angles = random_state.uniform(0, 2 * np.pi, size=n_outside)
+            offsets = np.column_stack((distances * np.cos(angles), distances * np.sin(angles)))
+            refined_points[is_outside] = centers[center_ids[is_outside]] + offsets
+            is_outside = np.any((refined_points < lower_left) | (refined_points > upper_right), axis=1)
+
+        n_coarse_points = min(configs.GRID_COARSE_SIZE, configs.GRID_SIZE)
+        n_refined_points = configs.GRID_SIZE - n_coarse_points
+        if len(refined_points) > n_refined_points:
+            refined_points = refined_points[random_state.choice(len(refined_points), n_refined_points, replace=False)]
+
+        return np.vstack((self._sample_uniform_points(random_state, n_coarse_points), refined_points))
+
+    def get_points_of_interest(self) -> np.ndarray:
+        """
+        Точки, кроме терминальных, вокруг которых сгущается многоуровневая сетка: переданные в конструктор, а по
+        умолчанию - начальные 'точки Штейнера' (utils.compute_steiner_candidate_points).
+
+        :return:
+        """
+        if self.points_of_interest is not None:
+            return np.asarray(self.points_of_interest, dtype=np.float64).reshape(-1, 2)
+
+        return utils.compute_steiner_candidate_points(self.terminal_points)
+
+    def cache_key(self) -> str:
+        """
+        Ключ сетки в кэше: хэш терминальных точек, зерна генератора и параметров сетки.
+
+        :return:
+        """
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(self.terminal_points, dtype=np.float64).tobytes())
+        if configs.GRID_SAMPLING == "adaptive":
+            digest.update(np.ascontiguousarray(self.get_points_of_interest()).tobytes())
+        digest.update(repr(self.seed).encode())
+        digest.update(repr([getattr(configs, name) for name in self.CACHE_KEY_CONFIGS]).encode())
+
+        return digest.hexdigest()
+
+    def save(self, path):
+        """
+        Сохранение сетки в каталог: точки, матрица смежности в формате CSR и вычисленные строки матриц расстояний и
+        предшественников. Каждый массив хранится в отдельном файле .npy, чтобы его можно было отобразить в память.
+
+        Каталог сначала заполняется под временным именем и затем переименовывается, поэтому параллельные задачи не
+        видят частично записанную сетку.
+
+        :param path:
+        :return:
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        connectivity_matrix = csr_matrix(self.connectivity_matrix)
+        if self.shortest_paths is None:
+            sources = np.arange(self.points.shape[0])
+            distances, predecessors = self.distance_matrix, self.predecessors
+        else:
+            sources = np.array(list(self.shortest_paths.distance_rows), dtype=np.int64)
+            distances = np.vstack([self.shortest_paths.distance_rows[source] for source in sources])
+            predecessors = np.vstack([self.shortest_paths.predecessor_rows[source] for source in sources])
+
+        arrays = {
+            "points": self.points,
+            "indptr": connectivity_matrix.indptr,
+            "indices": connectivity_matrix.indices,
+            "data": connectivity_matrix.data,
+            "sources": sources,
+            "distances": distances,
+            "predecessors": predecessors,
+        }
+
+        tmp_path = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+        try:
+            for name, array in arrays.items():
+                np.save(tmp_path / f"{name}.npy", np.asarray(array))
+            os.rename(tmp_path, path)
+        except OSError:
+            if not path.is_dir():
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def load(self, path, mmap_mode="r"):
+        """
+        Загрузка сетки, сохраненной методом save. Строки матриц расстояний и предшественников отображаются в память
+        и не копируются. Кратчайшие пути от новых источников вычисляются как обычно.
+
+        :param path:
+        :param mmap_mode: Режим отображения массивов в память, None - полная загрузка.
+        :return:
+        """
+        path = Path(path)
+
+        def load_array(name):
+            return np.load(path / f"{name}.npy", mmap_mode=mmap_mode)
+
+        points = load_array("points")
+        n_terminals = len(self.terminal_points)
+        if points.shape[0] < n_terminals or not np.allclose(points[:n_terminals], self.terminal_points):
+            raise ValueError(f"Сетка в {path} построена для других терминальных точек.")
+
+        self.points = np.asarray(points)
+        self.kd_tree = KDTree(self.points)
+
+        n_points = self.points.shape[0]
+        self.connectivity_matrix = csr_matrix((load_array("data"), load_array("indices"), load_array("indptr")),
+                                              shape=(n_points, n_points))
+        if not configs.SPARSE_GRID:
+            self.connectivity_matrix = self.connectivity_matrix.toarray()
+
+        sources = np.load(path / "sources.npy")
+        distances = load_array("distances")
+        predecessors = load_array("predecessors")
+        if configs.ALL_PAIRS_SHORTEST_PATHS and len(sources) == n_points:
+            self.shortest_paths = None
+            self.distance_matrix, self.predecessors = distances, predecessors
+        else:
+            self.shortest_paths = ShortestPaths(self.connectivity_matrix)
+            for source, distance_row, predecessor_row in zip(sources.tolist(), distances, predecessors):
+                self.shortest_paths.distance_rows[source] = distance_row
+                self.shortest_paths.predecessor_rows[source] = predecessor_row
+            self.shortest_paths.add_sources(range(n_terminals))
+            self.distance_matrix = self.shortest_paths.distance_matrix
+            self.predecessors = self.shortest_paths.predecessors
+
+        self.path_cache = PathCache(configs.PATH_CACHE_SIZE)
+
+    def add_sources(self, sources):
+        """
+        Предварительный расчет кратчайших путей от заданных вершин сетки.
+
+        :param sources:
+        :return:
+        """
+        if self.shortest_paths is not None:
+            self.shortest_paths.add_sources(sources)
+
+    @instrumentation.timed()
+    def _build_connectivity_matrix(self):
+        """
+        Матрица смежности триангуляции Делоне. Веса ребер - евклидовы длины.
+
+        При configs.SPARSE_GRID матрица хранится в формате CSR и занимает память, линейную по числу точек сетки.
+
+        :return:
+        """
         tri = Delaunay(self.points)
-        indices, indptr = tri.vertex_neighbor_vertices
-        self.connectivity_matrix = np.zeros((self.points.shape[0], self.points.shape[0]))
-        for ind in range(len(self.points)):
-            neighbours = indptr[indices[ind]:indices[ind + 1]]
-            vectors = self.points[ind].reshape(1, -1).T - self.points[neighbours].T
-            distances = np.linalg.norm(vectors, axis=0)
-            self.connectivity_matrix[ind, neighbours] = distances
-        self.distance_matrix, self.predecessors = dijkstra(self.connectivity_matrix, return_predecessors=True)
+        indptr, neighbours = tri.vertex_neighbor_vertices
+
+        n_points = self.points.shape[0]
+        rows = np.repeat(np.arange(n_points), np.diff(indptr))
+        lengths = np.linalg.norm(self.points[rows] - self.points[neighbours], axis=1)
+
+        connectivity_matrix = csr_matrix((lengths, neighbours, indptr), shape=(n_points, n_points))
+        if not configs.SPARSE_GRID:
+            connectivity_matrix = connectivity_matrix.toarray()
+
+        return connectivity_matrix
 
+    @instrumentation.timed()
     def reconstruct_path(self, u, v):
         """
         Восстановленный путь от вершины u до вершины v в виде LineString
@@ -64,31 +443,130 @@ class Grid:
         :param v:
         :return:
         """
-        assert u != v
 
-        points = list()
-        while u != v:
-            points.append(self.points[v])
-            v = self.predecessors[u, v]
-        points.append(self.points[u])
+        return self.reconstruct_lines([(u, v)])[0]
 
-        return LineString(reversed(points))
+    @instrumentation.timed()
+    def reconstruct_lines(self, pairs):
+        """
+        Восстановленные пути для списка пар вершин в виде LineString. Пути, которых нет в кэше, восстанавливаются вместе.
+
+        :param pairs:
+        :return:
+        """
+
+        return [LineString(coords) for coords in self._get_oriented_coords(pairs)]
 
-    def create_network(self, graph: nx.Graph):
+    def path_length(self, u, v):
         """
-        Создание сети на основе переданного графа.
+        Длина восстановленного пути между вершинами u и v.
 
+        :param u:
+        :param v:
         :return:
         """
+        _, _, length = self._get_cached_paths([(u, v)])[0]
+
+        return length
 
-        vertices = list(graph.nodes)
-        quarry_capacities = {ind: 1e2 for ind in self.quarries_indices}
+    @instrumentation.timed()
+    def reconstruct_paths(self, pairs):
+        """
+        Одновременное восстановление путей для списка пар вершин.
 
-        incidence_list = list()
-        for u, v in graph.edges:
-            line = self.reconstruct_path(u, v)
-            incidence_list.append((u, v, line))
+        Все пути проходятся по матрице предшественников одновременно, поэтому число итераций равно длине самого
+        длинного пути, а не суммарной длине путей.
+
+        :param pairs: Пары (u, v), u != v.
+        :return: Координаты всех путей подряд, массив формы (n_points, 2), и смещения, массив длины len(pairs) + 1.
+        Путь i от u до v - coords[offsets[i]:offsets[i + 1]].
+        """
+
+        sources = np.array([u for u, _ in pairs], dtype=np.int64)
+        targets = np.array([v for _, v in pairs], dtype=np.int64)
+        assert np.all(sources != targets)
+
+        unique_sources, source_rows = np.unique(sources, return_inverse=True)
+        predecessors = np.vstack([self.predecessors[source] for source in unique_sources])
+
+        # Вершины путей в обратном порядке: history[0] - v, далее предшественники до u включительно.
+        history = [targets]
+        current = targets.copy()
+        active = current != sources
+        while np.any(active):
+            current = np.where(active, predecessors[source_rows, current], -1)
+            history.append(current)
+            active &= current != sources
+        history = np.vstack(history)
+
+        n_points = np.count_nonzero(history >= 0, axis=0)
+        offsets = np.concatenate(([0], np.cumsum(n_points)))
+
+        path_ids = np.repeat(np.arange(len(pairs)), n_points)
+        positions = np.arange(offsets[-1]) - offsets[path_ids]
+        vertices = history[n_points[path_ids] - 1 - positions, path_ids]
+
+        return self.points[vertices], offsets
+
+    def _get_cached_paths(self, pairs):
+        """
+        Пути из кэша в виде (первая вершина, координаты, длина). Отсутствующие пути восстанавливаются вместе.
+
+        :param pairs:
+        :return:
+        """
+        keys = [edge_key(int(u), int(v)) for u, v in pairs]
+        cached_paths = [self.path_cache.get(key) for key in keys]
+
+        missing = [ind for ind, cached_path in enumerate(cached_paths) if cached_path is None]
+        if missing:
+            coords, offsets = self.reconstruct_paths([pairs[ind] for ind in missing])
+            lengths = utils.compute_lines_lengths(coords, offsets)
+            for ind, start, end, length in zip(missing, offsets[:-1], offsets[1:], lengths.tolist()):
+                cached_paths[ind] = (pairs[ind][0], coords[start:end].copy(), length)
+                self.path_cache.put(keys[ind], cached_paths[ind])
+
+        return cached_paths
+
+    def _get_oriented_coords(self, pairs):
+        """
+        Координаты путей из кэша, направленные от первой вершины пары ко второй.
+
+        :param pairs:
+        :return:
+        """
+
+        return [coords if start == u else coords[::-1]
+                for (u, _), (start, coords, _) in zip(pairs, self._get_cached_paths(pairs))]
+
+    def with_quarry_capacities(self, quarry_capacities: dict) -> "Grid":
+        """
+        Сетка с другими объемами карьеров. Точки, кратчайшие пути и кэш путей разделяются с исходной сеткой.
+
+        :param quarry_capacities:
+        :return:
+        """
+        grid = copy.copy(self)
+        grid.quarry_capacities = dict(quarry_capacities)
+
+        return grid
+
+    def create_network(self, graph: Union[Graph, CompleteGraph]):
+        """
+        Создание сети на основе переданного графа. Координаты путей передаются в сеть одним массивом, объекты shapely
+        для ребер не создаются.
+
+        :return:
+        """
 
-        network = Network(vertices=vertices, quarry_capacities=quarry_capacities, incidence_list=incidence_list)
+        edges = list(graph.edges)
+        paths = self._get_oriented_coords(edges)
+        if paths:
+            coords = np.concatenate(paths)
+            offsets = np.concatenate(([0], np.cumsum([len(path) for path in paths])))
+        else:
+            coords = np.zeros((0, 2))
+            offsets = np.zeros(1, dtype=np.int64)
 
-        return network
+        return Network.from_arrays(list(graph.nodes), dict(self.quarry_capacities), np.array(edges, dtype=np.int64),
+                                   coords, offsets)
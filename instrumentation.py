@@ -0,0 +1,196 @@
+"""
+Счетчики и таймеры горячих участков кода.
+
+Инструментирование включается параметром configs.INSTRUMENTATION или функцией enable(). Параметр читается при каждой
+проверке, поэтому его можно изменить после импорта модуля; enable() и disable() имеют приоритет над ним. В выключенном
+состоянии декоратор timed добавляет к вызову только проверку флага, а timer возвращает общий пустой контекстный
+менеджер.
+
+Время вложенных участков входит во время внешних. Статистика собирается в текущем процессе: вызовы в процессах
+пулов (configs.N_WORKERS > 1, batch.py) в отчет основного процесса не попадают.
+
+Пример:
+
+    instrumentation.enable()
+    ...
+    print(instrumentation.format_report())
+    instrumentation.add_exporter(lambda report: metrics_client.send(report))
+    instrumentation.export()
+"""
+
+import functools
+from collections import defaultdict
+from time import perf_counter
+
+import configs
+
+# None - состояние задается параметром configs.INSTRUMENTATION.
+_enabled = None
+
+# Имя участка -> [число вызовов, суммарное время, максимальное время].
+_timers = defaultdict(lambda: [0, 0.0, 0.0])
+_counters = defaultdict(lambda: 0)
+_exporters = list()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return configs.INSTRUMENTATION if _enabled is None else _enabled
+
+
+def reset():
+    """
+    Сброс собранной статистики.
+
+    :return:
+    """
+    _timers.clear()
+    _counters.clear()
+
+
+def _record(name: str, elapsed_time: float):
+    stats = _timers[name]
+    stats[0] += 1
+    stats[1] += elapsed_time
+    stats[2] = max(stats[2], elapsed_time)
+
+
+class _Timer:
+
+    __slots__ = ("name", "start_time")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, perf_counter() - self.start_time)
+
+
+class _NullTimer:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """
+    Контекстный менеджер, замеряющий время выполнения участка.
+
+    :param name:
+    :return:
+    """
+    return _Timer(name) if is_enabled() else _NULL_TIMER
+
+
+def timed(name: str = None):
+    """
+    Декоратор, замеряющий число вызовов и время выполнения функции.
+
+    :param name: Имя участка в отчете. По умолчанию - полное имя функции, например "Network.split_edge".
+    :return:
+    """
+
+    def decorator(function):
+        timer_name = function.__qualname__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Проверка is_enabled() без вызова функции: декоратор стоит на горячих участках.
+            if not (configs.INSTRUMENTATION if _enabled is None else _enabled):
+                return function(*args, **kwargs)
+
+            start_time = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(timer_name, perf_counter() - start_time)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """
+    Увеличение счетчика.
+
+    :param name:
+    :param value:
+    :return:
+    """
+    if is_enabled():
+        _counters[name] += value
+
+
+def report() -> dict:
+    """
+    Собранная статистика. Таймеры упорядочены по убыванию суммарного времени.
+
+    :return: Словарь {"timers": {имя: {calls, total_time, mean_time, max_time}}, "counters": {имя: значение}}.
+    """
+    timers = dict()
+    for name, (calls, total_time, max_time) in sorted(_timers.items(), key=lambda item: -item[1][1]):
+        timers[name] = {"calls": calls, "total_time": total_time, "mean_time": total_time / calls, "max_time": max_time}
+
+    return {"timers": timers, "counters": dict(sorted(_counters.items()))}
+
+
+def format_report() -> str:
+    """
+    Отчет в виде таблицы.
+
+    :return:
+    """
+    stats = report()
+
+    lines = [f"{'Участок':<50} {'Вызовов':>10} {'Всего, с':>10} {'Среднее, мс':>12} {'Макс., мс':>10}"]
+    for name, timer_stats in stats["timers"].items():
+        lines.append(f"{name:<50} {timer_stats['calls']:>10} {timer_stats['total_time']:>10.3f} "
+                     f"{1e3 * timer_stats['mean_time']:>12.3f} {1e3 * timer_stats['max_time']:>10.3f}")
+    for name, value in stats["counters"].items():
+        lines.append(f"{name:<50} {value:>10}")
+
+    return "\n".join(lines)
+
+
+def add_exporter(exporter):
+    """
+    Регистрация функции экспорта статистики, например в систему метрик. Функция получает результат report().
+
+    :param exporter:
+    :return:
+    """
+    _exporters.append(exporter)
+
+
+def export():
+    """
+    Передача статистики всем зарегистрированным функциям экспорта.
+
+    :return:
+    """
+    stats = report()
+    for exporter in _exporters:
+        exporter(stats)
@@ -1,5 +1,6 @@
 from pathlib import Path
 
+import instrumentation
 import painter
 import utils
 from edges_splitter import EdgesSplitter
@@ -31,6 +32,9 @@ g.generate()
 
 nb = NetworkBuilder(g)
 network = nb.build_network()
+print(f"Стоимость MST: {nb.best_cost}. Оценено кандидатов: {nb.stats['evaluated_candidates']}, "
+      f"отсечено: {nb.stats['pruned_candidates']}, по прошлым оценкам: {nb.stats['reused_candidates']}, "
+      f"раундов: {nb.stats['rounds']}, добавлено точек: {nb.stats['accepted_points']}")
 
 splitter = EdgesSplitter(network)
 splitter.calculate()
@@ -41,3 +45,7 @@ painter.draw_calculated_road_network(splitter.road_network)
 cost = utils.compute_road_network_cost(splitter.road_network)
 
 print(f"Стоимость строительства дорожной сети: {cost}")
+
+if instrumentation.is_enabled():
+    print(instrumentation.format_report())
+    instrumentation.export()
@@ -2,22 +2,68 @@
 Класс, объединяющий в себе логику работы с графом.
 """
 
-from collections import defaultdict
+import copy
+import re
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple, FrozenSet, DefaultDict
+from typing import List, Dict, Tuple
 
-import networkx as nx
 import numpy as np
 import shapely.wkt as wkt
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 from shapely.geometry import Point, LineString
 
+import configs
+import instrumentation
 import utils
+from graph import Graph
 from utils import edge_key
 
+# Начальный размер массивов ребер и вершин. При нехватке места размер удваивается.
+INITIAL_CAPACITY = 16
+
+# Координаты ломаной в WKT без вложенных скобок, например "LINESTRING (0 0, 1 1)".
+_LINESTRING_PATTERN = re.compile(r"LINESTRING\s*\(([^()]*)\)", re.IGNORECASE)
+
+
+def _grow(array: np.ndarray, size: int, fill_value) -> np.ndarray:
+    """
+    Увеличение массива по первой оси так, чтобы в нем помещалось size строк.
+
+    :param array:
+    :param size:
+    :param fill_value: Значение для новых строк.
+    :return:
+    """
+    if size <= array.shape[0]:
+        return array
+
+    new_array = np.full((max(size, 2 * array.shape[0]),) + array.shape[1:], fill_value, dtype=array.dtype)
+    new_array[:array.shape[0]] = array
+
+    return new_array
+
 
 class Network:
     """
     Класс, объединяющий в себе логику работы с графом.
+
+    Состояние ребер хранится в массивах, индексируемых целочисленным идентификатором ребра (хранится в графе для каждой пары смежных вершин):
+    edge_first, edge_last, edge_length, edge_weight, edge_quarry, edge_original, edge_alive и список edge_lines.
+    Расстояния до карьеров хранятся в матрице quarry_distances размера вершины x карьеры, строки которой задаются
+    vertex_rows (обратное отображение - row_vertices), а столбцы - quarry_columns. Массивы заполнены только до n_edges
+    и n_vertices и при росте пересоздаются.
+
+    Для поиска ближайшего непустого карьера у каждой вершины хранится порядок карьеров по возрастанию расстояния
+    (quarry_order) и указатель на первый непустой из них (nearest_pointers). Опустошенные карьеры отмечаются в общем
+    массиве quarry_exhausted, при продвижении указателя объем карьера перепроверяется. Так как карьеры только
+    опустошаются, указатели двигаются только вперед: объем карьеров можно уменьшать напрямую или через
+    consume_quarry и empty_quarry, но не увеличивать.
+
+    Атрибуты edge_to_line_mapping, first_poit_vertex, last_point_vertex, edge_attached_quarry, original_edge,
+    distances_to_quarries и second_vertex_in_path - представления этих массивов со старым интерфейсом словарей.
     """
 
     def __init__(self,
@@ -35,20 +81,39 @@ class Network:
         self.quarries = set(quarry_capacities.keys())
         self.usual_vertices = set(vertices) - self.quarries
         self.quarries_capacities = dict(quarry_capacities)
-
-        self.graph = nx.Graph()
+        self.quarry_columns = {quarry: column for column, quarry in enumerate(self.quarries)}
+        self.ordered_quarries = list(self.quarries)
+
+        self.n_vertices = 0
+        self.vertex_rows = dict()
+        self.row_vertices = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.quarry_distances = np.full((INITIAL_CAPACITY, len(self.quarries)), np.inf)
+        self.quarry_predecessors = np.full((INITIAL_CAPACITY, len(self.quarries)), -1, dtype=np.int64)
+        self.quarry_order = np.zeros((INITIAL_CAPACITY, len(self.quarries)), dtype=np.int64)
+        self.quarry_order_valid = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.nearest_pointers = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.quarry_exhausted = np.array([np.isclose(self.quarries_capacities[quarry], 0) for quarry in self.ordered_quarries], dtype=bool)
+
+        self.n_edges = 0
+        self.edge_first = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.edge_last = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.edge_length = np.zeros(INITIAL_CAPACITY)
+        self.edge_weight = np.zeros(INITIAL_CAPACITY)
+        self.edge_quarry = np.full(INITIAL_CAPACITY, -1, dtype=np.int64)
+        self.edge_original = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.edge_alive = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.edge_lines = _EdgeLines()
+
+        self.graph = Graph()
+        self.available_vertex_id = max(vertices)
         for vertex in vertices:
             self.graph.add_node(vertex)
-        self.available_vertex_id = max(vertices)
+            self._add_vertex(vertex)
 
-        self.first_poit_vertex = dict()
-        self.last_point_vertex = dict()
         self.vertex_to_point_mapping = dict()
-        self.edge_to_line_mapping = dict()
         for u, v, line in incidence_list:
-            self.graph.add_edge(u, v, weight=line.length)
-            self.first_poit_vertex[edge_key(u, v)] = u
-            self.last_point_vertex[edge_key(u, v)] = v
+            edge_id = self._add_edge(u, v, line, line.length)
+            self.graph.add_edge(u, v, edge_id)
 
             if u in self.vertex_to_point_mapping:
                 utils.assert_points_are_close(self.vertex_to_point_mapping[u], Point(line.coords[0]))
@@ -58,15 +123,175 @@ class Network:
                 utils.assert_points_are_close(self.vertex_to_point_mapping[v], Point(line.coords[-1]))
             self.vertex_to_point_mapping[v] = Point(line.coords[-1])
 
-            self.edge_to_line_mapping[edge_key(u, v)] = line
+        self._create_views()
 
-        self.edge_attached_quarry: Dict[FrozenSet[int], int] = dict()
-        self.distances_to_quarries: DefaultDict[int, Dict[int, float]] = defaultdict(dict)
-        self.second_vertex_in_path: DefaultDict[int, Dict[int, float]] = defaultdict(dict)
+    def _create_views(self):
+        """
+        Создание представлений массивов в виде словарей.
 
-        self.original_edge = dict()
-        for u, v in self.graph.edges:
-            self.original_edge[edge_key(u, v)] = edge_key(u, v)
+        :return:
+        """
+        self.edge_to_line_mapping = _EdgeLinesView(self)
+        self.first_poit_vertex = _EdgeFirstVertexView(self)
+        self.last_point_vertex = _EdgeLastVertexView(self)
+        self.edge_attached_quarry = _EdgeAttachedQuarryView(self)
+        self.original_edge = _OriginalEdgeView(self)
+        self.distances_to_quarries = _VerticesView(self, _DistancesRowView)
+        self.second_vertex_in_path = _VerticesView(self, _PredecessorsRowView)
+
+    def copy(self) -> "Network":
+        """
+        Независимая копия сети. Геометрия ребер и вершин не копируется, а разделяется с исходной сетью,
+        так как объекты shapely не изменяются.
+
+        :return:
+        """
+        network = copy.copy(self)
+
+        network.quarries = set(self.quarries)
+        network.usual_vertices = set(self.usual_vertices)
+        network.quarries_capacities = dict(self.quarries_capacities)
+        network.vertex_rows = dict(self.vertex_rows)
+        network.vertex_to_point_mapping = self.vertex_to_point_mapping.copy()
+        network.edge_lines = self.edge_lines.copy()
+        network.graph = self.graph.copy()
+
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray):
+                setattr(network, name, value.copy())
+
+        network._create_views()
+
+        return network
+
+    def _add_vertex(self, vertex: int) -> int:
+        """
+        Добавление строки для вершины в матрицы расстояний до карьеров. Повторное добавление ничего не меняет.
+
+        :param vertex:
+        :return: Номер строки.
+        """
+        row = self.vertex_rows.get(vertex)
+        if row is not None:
+            return row
+
+        row = self.n_vertices
+        self.n_vertices += 1
+        self.available_vertex_id = max(self.available_vertex_id, vertex)
+        self.vertex_rows[vertex] = row
+        self.row_vertices = _grow(self.row_vertices, self.n_vertices, 0)
+        self.row_vertices[row] = vertex
+        self.quarry_distances = _grow(self.quarry_distances, self.n_vertices, np.inf)
+        self.quarry_predecessors = _grow(self.quarry_predecessors, self.n_vertices, -1)
+        self.quarry_order = _grow(self.quarry_order, self.n_vertices, 0)
+        self.quarry_order_valid = _grow(self.quarry_order_valid, self.n_vertices, False)
+        self.nearest_pointers = _grow(self.nearest_pointers, self.n_vertices, 0)
+
+        return row
+
+    def _add_edge(self, u: int, v: int, line, weight: float, original_edge_id: int = None,
+                  cumulative_lengths: np.ndarray = None) -> int:
+        """
+        Добавление ребра в массивы ребер.
+
+        :param u: Вершина, соответствующая первой точке ломаной.
+        :param v: Вершина, соответствующая последней точке ломаной.
+        :param line: LineString или массив координат ломаной.
+        :param weight: Вес ребра в графе.
+        :param original_edge_id: Идентификатор исходного ребра. По умолчанию ребро считается исходным.
+        :param cumulative_lengths: Накопленные длины отрезков ломаной, заданной массивом координат.
+        :return: Идентификатор ребра.
+        """
+        # Концы ребер, не переданные в списке вершин, добавляются в сеть, как при добавлении ребра в граф.
+        self._add_vertex(u)
+        self._add_vertex(v)
+
+        edge_id = self.n_edges
+        self.n_edges += 1
+
+        self.edge_first = _grow(self.edge_first, self.n_edges, 0)
+        self.edge_last = _grow(self.edge_last, self.n_edges, 0)
+        self.edge_length = _grow(self.edge_length, self.n_edges, 0)
+        self.edge_weight = _grow(self.edge_weight, self.n_edges, 0)
+        self.edge_quarry = _grow(self.edge_quarry, self.n_edges, -1)
+        self.edge_original = _grow(self.edge_original, self.n_edges, 0)
+        self.edge_alive = _grow(self.edge_alive, self.n_edges, False)
+
+        if isinstance(line, LineString):
+            self.edge_lines.append(line)
+            length = line.length
+        else:
+            self.edge_lines.append_coords(line, cumulative_lengths)
+            length = self.edge_lines.get_cumulative_lengths(edge_id)[-1]
+
+        self.edge_first[edge_id] = u
+        self.edge_last[edge_id] = v
+        self.edge_length[edge_id] = length
+        self.edge_weight[edge_id] = weight
+        self.edge_original[edge_id] = edge_id if original_edge_id is None else original_edge_id
+        self.edge_alive[edge_id] = True
+
+        return edge_id
+
+    def edge_id(self, u: int, v: int) -> int:
+        """
+        Идентификатор ребра между вершинами u и v.
+
+        :param u:
+        :param v:
+        :return:
+        """
+
+        return self.graph.edge_id(u, v)
+
+    def alive_edges(self) -> np.ndarray:
+        """
+        Идентификаторы существующих ребер в порядке добавления.
+
+        :return:
+        """
+
+        return np.flatnonzero(self.edge_alive[:self.n_edges])
+
+    def rows_of(self, vertices: np.ndarray) -> np.ndarray:
+        """
+        Номера строк матриц карьеров для массива вершин.
+
+        :param vertices:
+        :return:
+        """
+        row_vertices = self.row_vertices[:self.n_vertices]
+        sorter = np.argsort(row_vertices)
+
+        positions = np.searchsorted(row_vertices, vertices, sorter=sorter)
+        rows = sorter[np.minimum(positions, len(sorter) - 1)]
+        if np.any(row_vertices[rows] != vertices):
+            raise KeyError("Вершины отсутствуют в сети.")
+
+        return rows
+
+    def columns_of(self, quarries: np.ndarray) -> np.ndarray:
+        """
+        Номера столбцов матриц карьеров для массива карьеров.
+
+        :param quarries:
+        :return:
+        """
+        ordered_quarries = np.array(self.ordered_quarries, dtype=np.int64)
+        sorter = np.argsort(ordered_quarries)
+
+        return sorter[np.searchsorted(ordered_quarries, quarries, sorter=sorter)]
+
+    def distance(self, vertex: int, quarry: int) -> float:
+        """
+        Расстояние от вершины до карьера.
+
+        :param vertex:
+        :param quarry:
+        :return:
+        """
+
+        return self.quarry_distances[self.vertex_rows[vertex], self.quarry_columns[quarry]]
 
     def get_available_vertex_id(self):
         """
@@ -78,25 +303,58 @@ class Network:
 
         return self.available_vertex_id
 
+    @instrumentation.timed()
     def compute_distances_to_quarries(self):
         # language=rst
         """
         Вычисление расстояний до карьеров для каждой вершины.
 
+        Для всех карьеров выполняется один проход алгоритма Дейкстры по разреженной матрице смежности, который
+        сохраняет только расстояния и предшественников. При configs.N_DISTANCE_WORKERS > 1 карьеры распределяются
+        по потокам.
+
         :return:
         """
 
-        for quarry in self.quarries:
-            paths_lengths = nx.shortest_path_length(self.graph, source=quarry, weight="weight")
-            paths = nx.shortest_path(self.graph, source=quarry, weight="weight")
+        adjacency_matrix = self._build_adjacency_matrix()
+        quarry_rows = np.array([self.vertex_rows[quarry] for quarry in self.ordered_quarries], dtype=np.int64)
+
+        if configs.N_DISTANCE_WORKERS > 1 and len(quarry_rows) > 1:
+            chunks = np.array_split(quarry_rows, min(configs.N_DISTANCE_WORKERS, len(quarry_rows)))
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                results = list(executor.map(
+                    lambda chunk: dijkstra(adjacency_matrix, directed=False, indices=chunk, return_predecessors=True),
+                    chunks))
+            distances = np.vstack([chunk_distances for chunk_distances, _ in results])
+            predecessors = np.vstack([chunk_predecessors for _, chunk_predecessors in results])
+        else:
+            distances, predecessors = dijkstra(adjacency_matrix, directed=False, indices=quarry_rows, return_predecessors=True)
+
+        n_vertices = self.n_vertices
+        self.quarry_distances[:n_vertices] = distances.T
+        predecessors = predecessors.T
+        self.quarry_predecessors[:n_vertices] = np.where(predecessors >= 0, self.row_vertices[np.maximum(predecessors, 0)], -1)
+
+        self.quarry_order[:n_vertices] = np.argsort(self.quarry_distances[:n_vertices], axis=1, kind="stable")
+        self.quarry_order_valid[:n_vertices] = True
+        self.nearest_pointers[:n_vertices] = 0
+
+        usual_rows = [self.vertex_rows[facility] for facility in self.usual_vertices]
+        if not np.all(np.any(np.isfinite(self.quarry_distances[usual_rows]), axis=1)):
+            raise ValueError("Не для всех объектов существует путь до карьера.")
+
+    def _build_adjacency_matrix(self) -> csr_matrix:
+        """
+        Разреженная матрица смежности графа. Строки и столбцы соответствуют vertex_rows.
 
-            for facility, distance in paths_lengths.items():
-                self.distances_to_quarries[facility][quarry] = distance
-                self.second_vertex_in_path[facility][quarry] = paths[facility][-2] if len(paths[facility]) > 1 else None
+        :return:
+        """
 
-        for facility in self.usual_vertices:
-            if not self.distances_to_quarries[facility]:
-                raise ValueError("Не для всех объектов существует путь до карьера.")
+        alive_edges = self.alive_edges()
+        first_rows = self.rows_of(self.edge_first[alive_edges])
+        last_rows = self.rows_of(self.edge_last[alive_edges])
+
+        return csr_matrix((self.edge_weight[alive_edges], (first_rows, last_rows)), shape=(self.n_vertices, self.n_vertices))
 
     def traverse_edges_by_increasing_distance_to_quarry(self) -> List[Tuple[int]]:
         """
@@ -105,10 +363,12 @@ class Network:
         :return:
         """
 
+        min_distances = np.min(self.quarry_distances[:self.n_vertices], axis=1)
+
         distances_and_edges = []
         for u, v in self.graph.edges:
-            u_min_distance = min(self.distances_to_quarries[u].values())
-            v_min_distance = min(self.distances_to_quarries[v].values())
+            u_min_distance = min_distances[self.vertex_rows[u]]
+            v_min_distance = min_distances[self.vertex_rows[v]]
             edge_distance = min(u_min_distance, v_min_distance)
 
             distances_and_edges.append((edge_distance, (u, v)))
@@ -117,6 +377,7 @@ class Network:
 
         return list(map(lambda edge_tuple: edge_tuple[1], distances_and_edges))
 
+    @instrumentation.timed()
     def find_nearest_not_empty_quarry(self, vertex):
         """
         Поиск ближайшего карьера
@@ -124,15 +385,70 @@ class Network:
         :param facility:
         :return:
         """
-        min_value = None
-        min_key = None
-        for key, value in self.distances_to_quarries[vertex].items():
-            if not np.isclose(self.quarries_capacities[key], 0) and (min_value is None or value < min_value):
-                min_value = value
-                min_key = key
+        row = self.vertex_rows[vertex]
+        if not self.quarry_order_valid[row]:
+            self.quarry_order[row] = np.argsort(self.quarry_distances[row], kind="stable")
+            self.quarry_order_valid[row] = True
+            self.nearest_pointers[row] = 0
+
+        order = self.quarry_order[row]
+        pointer = self.nearest_pointers[row]
+        while pointer < len(order) and self._is_quarry_exhausted(order[pointer]):
+            pointer += 1
+        self.nearest_pointers[row] = pointer
+
+        if pointer == len(order) or not np.isfinite(self.quarry_distances[row, order[pointer]]):
+            return None
+
+        return self.ordered_quarries[order[pointer]]
+
+    def _is_quarry_exhausted(self, column: int) -> bool:
+        """
+        Опустошен ли карьер. Кроме отметки в quarry_exhausted проверяется текущий объем карьера, так как
+        quarries_capacities может быть уменьшен напрямую, минуя consume_quarry и empty_quarry.
+
+        :param column: Столбец карьера.
+        :return:
+        """
+        if not self.quarry_exhausted[column]:
+            capacity = self.quarries_capacities[self.ordered_quarries[column]]
+            # То же, что np.isclose(capacity, 0), без накладных расходов numpy на скаляре.
+            self.quarry_exhausted[column] = abs(capacity) <= 1e-8
+
+        return self.quarry_exhausted[column]
+
+    def consume_quarry(self, quarry: int, volume: float):
+        """
+        Забор объема материалов из карьера.
 
-        return min_key
+        :param quarry:
+        :param volume:
+        :return:
+        """
+        self.quarries_capacities[quarry] -= volume
+        if np.isclose(self.quarries_capacities[quarry], 0):
+            self.quarry_exhausted[self.quarry_columns[quarry]] = True
+
+    def empty_quarry(self, quarry: int):
+        """
+        Опустошение карьера.
+
+        :param quarry:
+        :return:
+        """
+        self.quarries_capacities[quarry] = 0
+        self.quarry_exhausted[self.quarry_columns[quarry]] = True
+
+    def _invalidate_quarry_order(self, row: int):
+        """
+        Сброс порядка карьеров для строки после изменения расстояний.
 
+        :param row:
+        :return:
+        """
+        self.quarry_order_valid[row] = False
+
+    @instrumentation.timed()
     def split_edge(self, start_vertex: int, end_vertex: int, new_edge_length: float, from_end=False) -> Tuple[int, int, int]:
         """
         Разбиение ребра на два. Длина нового ребра должна быть меньше длины текущего. Длина нового ребра отсчитывается от первой точки.
@@ -142,45 +458,39 @@ class Network:
         :return:
         """
 
-        line = self.edge_to_line_mapping[edge_key(start_vertex, end_vertex)]
-        if from_end:
-            line = LineString(reversed(line.coords))
-
-        length = line.length
+        edge_id = self.edge_id(start_vertex, end_vertex)
+        length = self.edge_length[edge_id]
 
         assert new_edge_length < length, "Длина нового ребра при разбиении больше длины текущего."
 
         split_coeff = new_edge_length / length
 
-        new_point = line.interpolate(split_coeff, normalized=True)
-        start_line, end_line = utils.split_line_string_by_point(line, new_point)
+        start_coords, end_coords, start_cumulative_lengths, end_cumulative_lengths = utils.split_coords_by_distance(
+            self.edge_lines.get_coords(edge_id), new_edge_length, self.edge_lines.get_cumulative_lengths(edge_id),
+            from_end=from_end)
+        new_point = Point(end_coords[0])
 
         self.graph.remove_edge(start_vertex, end_vertex)
-        del self.edge_to_line_mapping[edge_key(start_vertex, end_vertex)]
-        del self.first_poit_vertex[edge_key(start_vertex, end_vertex)]
-        del self.last_point_vertex[edge_key(start_vertex, end_vertex)]
+        self.edge_alive[edge_id] = False
+        self.edge_lines.remove(edge_id)
 
         new_vertex = self.get_available_vertex_id()
 
         self.graph.add_node(new_vertex)
+        self._add_vertex(new_vertex)
         self.usual_vertices.add(new_vertex)
         self.vertex_to_point_mapping[new_vertex] = new_point
 
-        self.graph.add_edge(start_vertex, new_vertex, weight=length * split_coeff)
-        self.graph.add_edge(new_vertex, end_vertex, weight=length * (1 - split_coeff))
-        self.first_poit_vertex[edge_key(start_vertex, new_vertex)] = start_vertex
-        self.first_poit_vertex[edge_key(new_vertex, end_vertex)] = new_vertex
-        self.last_point_vertex[edge_key(start_vertex, new_vertex)] = new_vertex
-        self.last_point_vertex[edge_key(new_vertex, end_vertex)] = end_vertex
-        self.edge_to_line_mapping[edge_key(start_vertex, new_vertex)] = start_line
-        self.edge_to_line_mapping[edge_key(new_vertex, end_vertex)] = end_line
+        original_edge_id = self.edge_original[edge_id]
+        first_edge_id = self._add_edge(start_vertex, new_vertex, start_coords, length * split_coeff, original_edge_id,
+                                       start_cumulative_lengths)
+        second_edge_id = self._add_edge(new_vertex, end_vertex, end_coords, length * (1 - split_coeff), original_edge_id,
+                                        end_cumulative_lengths)
+        self.graph.add_edge(start_vertex, new_vertex, first_edge_id)
+        self.graph.add_edge(new_vertex, end_vertex, second_edge_id)
 
         self._recompute_paths(start_vertex, end_vertex, new_vertex)
 
-        self.original_edge[edge_key(start_vertex, new_vertex)] = self.original_edge[edge_key(start_vertex, end_vertex)]
-        self.original_edge[edge_key(new_vertex, end_vertex)] = self.original_edge[edge_key(start_vertex, end_vertex)]
-        del self.original_edge[edge_key(start_vertex, end_vertex)]
-
         return start_vertex, new_vertex, end_vertex
 
     def _recompute_paths(self, start_vertex, end_vertex, new_vertex):
@@ -193,56 +503,497 @@ class Network:
         :return:
         """
 
-        first_new_length = self.graph.get_edge_data(start_vertex, new_vertex)["weight"]
-        new_second_length = self.graph.get_edge_data(end_vertex, new_vertex)["weight"]
+        first_new_length = self.edge_weight[self.edge_id(start_vertex, new_vertex)]
+        new_second_length = self.edge_weight[self.edge_id(end_vertex, new_vertex)]
 
-        self.distances_to_quarries[new_vertex] = dict()
-        self.second_vertex_in_path[new_vertex] = dict()
+        start_row = self.vertex_rows[start_vertex]
+        end_row = self.vertex_rows[end_vertex]
+        new_row = self.vertex_rows[new_vertex]
 
-        for quarry, first_distance in self.distances_to_quarries[start_vertex].items():
-            second_distance = self.distances_to_quarries[end_vertex][quarry]
-            if first_distance + first_new_length < second_distance + new_second_length:
-                self.distances_to_quarries[new_vertex][quarry] = first_distance + first_new_length
-                self.second_vertex_in_path[new_vertex][quarry] = start_vertex
-            else:
-                self.distances_to_quarries[new_vertex][quarry] = second_distance + new_second_length
-                self.second_vertex_in_path[new_vertex][quarry] = end_vertex
+        first_distances = self.quarry_distances[start_row] + first_new_length
+        second_distances = self.quarry_distances[end_row] + new_second_length
+        is_first_closer = first_distances < second_distances
 
-        for quarry, second_vertex_in_path in self.second_vertex_in_path[end_vertex].items():
-            if second_vertex_in_path == start_vertex:
-                self.second_vertex_in_path[end_vertex][quarry] = new_vertex
+        self.quarry_distances[new_row] = np.where(is_first_closer, first_distances, second_distances)
+        self.quarry_predecessors[new_row] = np.where(is_first_closer, start_vertex, end_vertex)
+        self._invalidate_quarry_order(new_row)
 
-        for quarry, second_vertex_in_path in self.second_vertex_in_path[start_vertex].items():
-            if second_vertex_in_path == end_vertex:
-                self.second_vertex_in_path[start_vertex][quarry] = new_vertex
+        end_predecessors = self.quarry_predecessors[end_row]
+        end_predecessors[end_predecessors == start_vertex] = new_vertex
+
+        start_predecessors = self.quarry_predecessors[start_row]
+        start_predecessors[start_predecessors == end_vertex] = new_vertex
 
     @classmethod
+    def from_arrays(cls,
+                    vertices: List[int],
+                    quarry_capacities: Dict[int, float],
+                    edges: np.ndarray,
+                    coords: np.ndarray,
+                    offsets: np.ndarray) -> "Network":
+        """
+        Создание сети из плоских массивов без построения объектов shapely для каждого ребра. Ломаные создаются при
+        первом обращении к ним.
+
+        :param vertices: Идентификаторы вершин.
+        :param quarry_capacities: Объем материалов доступный для каждого из карьеров.
+        :param edges: Массив (n_edges, 2) первых и последних вершин ребер.
+        :param coords: Координаты всех ломаных подряд, массив (n_points, 2).
+        :param offsets: Смещения ломаных, массив длины n_edges + 1. Ломаная ребра i - coords[offsets[i]:offsets[i + 1]].
+        :return:
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        n_edges = edges.shape[0]
+        if len(offsets) != n_edges + 1 or offsets[0] != 0 or offsets[-1] != coords.shape[0] or np.any(np.diff(offsets) < 2):
+            raise ValueError("Смещения ломаных не соответствуют ребрам и координатам.")
+
+        network = cls(vertices, quarry_capacities, [])
+
+        lengths = utils.compute_lines_lengths(coords, offsets)
+
+        network.n_edges = n_edges
+        network.edge_first = _grow(network.edge_first, n_edges, 0)
+        network.edge_last = _grow(network.edge_last, n_edges, 0)
+        network.edge_length = _grow(network.edge_length, n_edges, 0)
+        network.edge_weight = _grow(network.edge_weight, n_edges, 0)
+        network.edge_quarry = _grow(network.edge_quarry, n_edges, -1)
+        network.edge_original = _grow(network.edge_original, n_edges, 0)
+        network.edge_alive = _grow(network.edge_alive, n_edges, False)
+
+        network.edge_first[:n_edges] = edges[:, 0]
+        network.edge_last[:n_edges] = edges[:, 1]
+        network.edge_length[:n_edges] = lengths
+        network.edge_weight[:n_edges] = lengths
+        network.edge_original[:n_edges] = np.arange(n_edges)
+        network.edge_alive[:n_edges] = True
+        network.edge_lines = _EdgeLines(coords, offsets)
+
+        network.graph.add_edges_from(
+            (u, v, edge_id) for edge_id, (u, v) in enumerate(zip(edges[:, 0].tolist(), edges[:, 1].tolist())))
+
+        endpoint_vertices = np.concatenate((edges[:, 0], edges[:, 1]))
+        endpoints = np.vstack((coords[offsets[:-1]], coords[offsets[1:] - 1]))
+        unique_vertices, first_occurrences, inverse = np.unique(endpoint_vertices, return_index=True, return_inverse=True)
+        for vertex in unique_vertices.tolist():
+            network._add_vertex(vertex)
+        vertex_points = endpoints[first_occurrences]
+        assert np.allclose(np.linalg.norm(endpoints - vertex_points[inverse.ravel()], axis=1), 0), "Точки не совпадают."
+        network.vertex_to_point_mapping = _VertexPoints(unique_vertices.tolist(), vertex_points)
+
+        return network
+
+    @classmethod
+    @instrumentation.timed()
     def read_from_file(cls, path: Path):
         """
-        Чтение сети из файла.
+        Чтение сети из файла. Файлы с расширением .npz читаются как бинарные (read_from_binary_file).
+
+        Текстовый файл читается целиком. Координаты всех ломаных разбираются в один массив numpy, объекты shapely для
+        ребер не создаются. WKT, не являющиеся простой записью LINESTRING, разбираются через shapely.
 
         :param path:
         :return:
         """
+        if Path(path).suffix == ".npz":
+            return cls.read_from_binary_file(path)
+
         with open(path) as f:
-            n_of_vertices = int(f.readline())
-            n_of_quarries = int(f.readline())
-            n_of_edges = int(f.readline())
+            lines = f.read().splitlines()
+
+        n_of_vertices = int(lines[0])
+        n_of_quarries = int(lines[1])
+        n_of_edges = int(lines[2])
+
+        vertices = list(map(int, lines[3].split()))
+
+        quarries_capacities = dict()
+        for line in lines[4:4 + n_of_quarries]:
+            vertex, capacity = line.split()
+            vertex = int(vertex)
+            capacity = float(capacity)
+            quarries_capacities[vertex] = capacity
+
+        edges = np.zeros((n_of_edges, 2), dtype=np.int64)
+        n_points = np.zeros(n_of_edges, dtype=np.int64)
+        coords_strings = list()
+        for ind, line in enumerate(lines[4 + n_of_quarries:4 + n_of_quarries + n_of_edges]):
+            u, v, wkt_line = line.split(maxsplit=2)
+            match = _LINESTRING_PATTERN.fullmatch(wkt_line.strip())
+            if match is None:
+                coords_string = ", ".join(f"{x!r} {y!r}" for x, y, *_ in wkt.loads(wkt_line).coords)
+            else:
+                coords_string = match.group(1)
+
+            edges[ind] = int(u), int(v)
+            n_points[ind] = coords_string.count(",") + 1
+            coords_strings.append(coords_string)
+
+        coords = np.array(" ".join(coords_strings).replace(",", " ").split(), dtype=np.float64)
+        if coords.shape[0] != 2 * n_points.sum():
+            raise ValueError(f"Ожидаются двумерные координаты ломаных в файле {path}.")
+
+        offsets = np.concatenate(([0], np.cumsum(n_points)))
+
+        return cls.from_arrays(vertices, quarries_capacities, edges, coords, offsets)
+
+    @classmethod
+    def read_from_binary_file(cls, path: Path):
+        """
+        Чтение сети из бинарного файла .npz, записанного write_to_binary_file.
+
+        :param path:
+        :return:
+        """
+        with np.load(path) as arrays:
+            quarries_capacities = dict(zip(arrays["quarries"].tolist(), arrays["capacities"].tolist()))
+
+            return cls.from_arrays(arrays["vertices"].tolist(), quarries_capacities, arrays["edges"], arrays["coords"],
+                                   arrays["offsets"])
+
+    def write_to_binary_file(self, path: Path):
+        """
+        Запись сети в бинарный файл .npz: вершины, объемы карьеров, концы ребер, координаты ломаных подряд и смещения.
+
+        :param path:
+        :return:
+        """
+        edge_ids = self.alive_edges()
+        lines = [self.edge_lines[edge_id] for edge_id in edge_ids]
+        n_points = np.array([len(line.coords) for line in lines], dtype=np.int64)
+        coords = np.vstack([np.asarray(line.coords)[:, :2] for line in lines]) if lines else np.zeros((0, 2))
+
+        np.savez(path,
+                 vertices=np.array(list(self.graph.nodes), dtype=np.int64),
+                 quarries=np.array(self.ordered_quarries, dtype=np.int64),
+                 capacities=np.array([self.quarries_capacities[quarry] for quarry in self.ordered_quarries]),
+                 edges=np.column_stack((self.edge_first[edge_ids], self.edge_last[edge_ids])),
+                 coords=coords,
+                 offsets=np.concatenate(([0], np.cumsum(n_points))))
+
+
+class _EdgeLines:
+    """
+    Ломаные ребер, индексируемые идентификатором ребра. Для ребер хранятся координаты ломаных и накопленные длины их
+    отрезков, объекты LineString создаются при первом обращении. Координаты ребер, созданных Network.from_arrays,
+    хранятся в общем буфере.
+    """
+
+    _NOT_BUILT = object()
+
+    def __init__(self, coords: np.ndarray = None, offsets: np.ndarray = None):
+
+        self.coords = coords
+        self.offsets = offsets
+        n_lines = 0 if offsets is None else len(offsets) - 1
+        self.lines = [self._NOT_BUILT] * n_lines
+        self.lines_coords = [None] * n_lines
+        self.cumulative_lengths = [None] * n_lines
+
+    def __getitem__(self, edge_id: int):
+        line = self.lines[edge_id]
+        if line is self._NOT_BUILT:
+            line = LineString(self.get_coords(edge_id))
+            self.lines[edge_id] = line
+
+        return line
+
+    def __len__(self):
+        return len(self.lines)
+
+    def get_coords(self, edge_id: int) -> np.ndarray:
+        """
+        Координаты ломаной ребра.
+
+        :param edge_id:
+        :return:
+        """
+        coords = self.lines_coords[edge_id]
+        if coords is None:
+            line = self.lines[edge_id]
+            if line is self._NOT_BUILT:
+                coords = self.coords[self.offsets[edge_id]:self.offsets[edge_id + 1]]
+            else:
+                coords = np.asarray(line.coords)
+            self.lines_coords[edge_id] = coords
+
+        return coords
+
+    def get_cumulative_lengths(self, edge_id: int) -> np.ndarray:
+        """
+        Накопленные длины отрезков ломаной ребра. Вычисляются один раз, для частей разбитых ребер передаются при
+        добавлении.
+
+        :param edge_id:
+        :return:
+        """
+        cumulative_lengths = self.cumulative_lengths[edge_id]
+        if cumulative_lengths is None:
+            cumulative_lengths = utils.compute_cumulative_lengths(self.get_coords(edge_id))
+            self.cumulative_lengths[edge_id] = cumulative_lengths
+
+        return cumulative_lengths
+
+    def append(self, line: LineString):
+        self.lines.append(line)
+        self.lines_coords.append(None)
+        self.cumulative_lengths.append(None)
+
+    def append_coords(self, coords: np.ndarray, cumulative_lengths: np.ndarray = None):
+        self.lines.append(self._NOT_BUILT)
+        self.lines_coords.append(coords)
+        self.cumulative_lengths.append(cumulative_lengths)
+
+    def remove(self, edge_id: int):
+        self.lines[edge_id] = None
+        self.lines_coords[edge_id] = None
+        self.cumulative_lengths[edge_id] = None
+
+    def copy(self) -> "_EdgeLines":
+        edge_lines = _EdgeLines()
+        edge_lines.coords = self.coords
+        edge_lines.offsets = self.offsets
+        edge_lines.lines = list(self.lines)
+        edge_lines.lines_coords = list(self.lines_coords)
+        edge_lines.cumulative_lengths = list(self.cumulative_lengths)
+
+        return edge_lines
+
+
+class _VertexPoints(MutableMapping):
+    """
+    Точки вершин. Для вершин сети, созданной Network.from_arrays, объекты Point создаются из массива points при первом
+    обращении, остальные точки хранятся в словаре built_points.
+    """
+
+    def __init__(self, vertices: List[int] = (), points: np.ndarray = None):
+
+        self.point_rows = {vertex: row for row, vertex in enumerate(vertices)}
+        self.points = points
+        self.built_points = dict()
+
+    def __getitem__(self, vertex):
+        point = self.built_points.get(vertex)
+        if point is None:
+            point = Point(self.points[self.point_rows[vertex]])
+            self.built_points[vertex] = point
+
+        return point
+
+    def __setitem__(self, vertex, point):
+        self.built_points[vertex] = point
+
+    def __delitem__(self, vertex):
+        if vertex not in self:
+            raise KeyError(vertex)
+
+        self.built_points.pop(vertex, None)
+        if vertex in self.point_rows:
+            # Словарь строк разделяется с копиями, поэтому перед изменением копируется.
+            self.point_rows = dict(self.point_rows)
+            del self.point_rows[vertex]
+
+    def __contains__(self, vertex):
+        return vertex in self.point_rows or vertex in self.built_points
+
+    def __iter__(self):
+        yield from self.point_rows
+        for vertex in self.built_points:
+            if vertex not in self.point_rows:
+                yield vertex
+
+    def __len__(self):
+        return len(self.point_rows) + sum(1 for vertex in self.built_points if vertex not in self.point_rows)
+
+    def copy(self) -> "_VertexPoints":
+        vertex_points = _VertexPoints()
+        vertex_points.point_rows = self.point_rows
+        vertex_points.points = self.points
+        vertex_points.built_points = dict(self.built_points)
+
+        return vertex_points
+
+
+class _EdgesView(MutableMapping):
+    """
+    Представление столбца ребер в виде словаря с ключами utils.edge_key(u, v). Подклассы определяют чтение значения
+    ребра по идентификатору (_get) и, если представление изменяемое, _set и _delete.
+    """
+
+    def __init__(self, network: Network):
+
+        self.network = network
+
+    def _set(self, edge_id: int, value):
+        raise TypeError("Представление доступно только для чтения.")
+
+    def _delete(self, edge_id: int):
+        raise TypeError("Представление доступно только для чтения.")
+
+    def _edge_id(self, key) -> int:
+        u, v = key
+        if not self.network.graph.has_edge(u, v):
+            raise KeyError(key)
+
+        return self.network.edge_id(u, v)
+
+    def __getitem__(self, key):
+        return self._get(self._edge_id(key))
+
+    def __setitem__(self, key, value):
+        self._set(self._edge_id(key), value)
+
+    def __delitem__(self, key):
+        self._delete(self._edge_id(key))
+
+    def __iter__(self):
+        for edge_id in self.network.alive_edges():
+            yield edge_key(int(self.network.edge_first[edge_id]), int(self.network.edge_last[edge_id]))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.network.edge_alive[:self.network.n_edges]))
+
+
+class _EdgeLinesView(_EdgesView):
+
+    def _get(self, edge_id: int):
+        return self.network.edge_lines[edge_id]
+
+
+class _EdgeFirstVertexView(_EdgesView):
+
+    def _get(self, edge_id: int):
+        return int(self.network.edge_first[edge_id])
+
+
+class _EdgeLastVertexView(_EdgesView):
+
+    def _get(self, edge_id: int):
+        return int(self.network.edge_last[edge_id])
+
+
+class _OriginalEdgeView(_EdgesView):
+
+    def _get(self, edge_id: int):
+        original_edge_id = self.network.edge_original[edge_id]
+
+        return edge_key(int(self.network.edge_first[original_edge_id]), int(self.network.edge_last[original_edge_id]))
+
+
+class _EdgeAttachedQuarryView(_EdgesView):
+
+    def _get(self, edge_id: int):
+        quarry = self.network.edge_quarry[edge_id]
+        if quarry < 0:
+            raise KeyError(edge_id)
+
+        return int(quarry)
+
+    def _set(self, edge_id: int, value):
+        self.network.edge_quarry[edge_id] = value
+
+    def _delete(self, edge_id: int):
+        self.network.edge_quarry[edge_id] = -1
+
+    def __iter__(self):
+        for key in super().__iter__():
+            if key in self:
+                yield key
+
+    def __len__(self):
+        alive_edges = self.network.alive_edges()
+
+        return int(np.count_nonzero(self.network.edge_quarry[alive_edges] >= 0))
+
+
+class _VerticesView(MutableMapping):
+    """
+    Представление матриц расстояний и предшественников в виде словаря вершина -> словарь карьер -> значение.
+    """
+
+    def __init__(self, network: Network, row_view_class):
+
+        self.network = network
+        self.row_view_class = row_view_class
+
+    def __getitem__(self, vertex):
+        return self.row_view_class(self.network, self.network._add_vertex(vertex))
+
+    def __setitem__(self, vertex, values):
+        row_view = self[vertex]
+        row_view.clear()
+        row_view.update(values)
+
+    def __delitem__(self, vertex):
+        self[vertex].clear()
+
+    def __iter__(self):
+        return iter(self.network.vertex_rows)
+
+    def __len__(self):
+        return len(self.network.vertex_rows)
+
+
+class _RowView(MutableMapping):
+    """
+    Представление строки матрицы карьеров в виде словаря. Карьеры, до которых нет пути, отсутствуют.
+    """
+
+    def __init__(self, network: Network, row: int):
+
+        self.network = network
+        self.row = row
+
+    def _column(self, quarry) -> int:
+        column = self.network.quarry_columns.get(quarry)
+        if column is None or not np.isfinite(self.network.quarry_distances[self.row, column]):
+            raise KeyError(quarry)
+
+        return column
+
+    def __iter__(self):
+        distances = self.network.quarry_distances[self.row]
+        for quarry, column in self.network.quarry_columns.items():
+            if np.isfinite(distances[column]):
+                yield quarry
+
+    def __len__(self):
+        return int(np.count_nonzero(np.isfinite(self.network.quarry_distances[self.row])))
+
+
+class _DistancesRowView(_RowView):
+
+    def __getitem__(self, quarry):
+        return float(self.network.quarry_distances[self.row, self._column(quarry)])
+
+    def __setitem__(self, quarry, distance):
+        self.network.quarry_distances[self.row, self.network.quarry_columns[quarry]] = distance
+        self.network._invalidate_quarry_order(self.row)
+
+    def __delitem__(self, quarry):
+        self.network.quarry_distances[self.row, self._column(quarry)] = np.inf
+        self.network._invalidate_quarry_order(self.row)
+
+    def clear(self):
+        self.network.quarry_distances[self.row] = np.inf
+        self.network._invalidate_quarry_order(self.row)
+
+
+class _PredecessorsRowView(_RowView):
 
-            vertices = list(map(int, f.readline().split()))
+    def __getitem__(self, quarry):
+        predecessor = self.network.quarry_predecessors[self.row, self._column(quarry)]
 
-            quarries_capacities = dict()
-            for _ in range(n_of_quarries):
-                vertex, capacity = f.readline().split()
-                vertex = int(vertex)
-                capacity = float(capacity)
-                quarries_capacities[vertex] = capacity
+        return None if predecessor < 0 else int(predecessor)
 
-            incidence_list = []
-            for _ in range(n_of_edges):
-                u, v, wkt_line = f.readline().split(maxsplit=2)
-                u, v, line = int(u), int(v), wkt.loads(wkt_line)
+    def __setitem__(self, quarry, predecessor):
+        column = self.network.quarry_columns[quarry]
+        self.network.quarry_predecessors[self.row, column] = -1 if predecessor is None else predecessor
 
-                incidence_list.append((u, v, line))
+    def __delitem__(self, quarry):
+        self.network.quarry_predecessors[self.row, self._column(quarry)] = -1
 
-        return cls(vertices, quarries_capacities, incidence_list)
+    def clear(self):
+        self.network.quarry_predecessors[self.row] = -1
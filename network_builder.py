@@ -1,43 +1,131 @@
-import copy
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
 
-import networkx as nx
 import numpy as np
 
 import configs
+import instrumentation
 import utils
-from edges_splitter import EdgesSplitter
+from candidate_evaluator import CandidateEvaluator
+from graph import CompleteGraph, Graph
 from grid import Grid
-from network import Network
 
-COST_TO_USE = "quarry_cost"
+# Построитель, доступный в процессах пула. Передается один раз при инициализации процесса.
+_worker_builder = None
+
+
+def _init_worker(builder: "NetworkBuilder"):
+    global _worker_builder
+    _worker_builder = builder
+
+
+def _evaluate_candidate_in_worker(args):
+    vertices, steiner_point_ind = args
+    graph = CompleteGraph(_worker_builder.grid, vertices)
+    return _worker_builder._evaluate_candidate(graph, steiner_point_ind)
+
 
 class NetworkBuilder:
     """
     Класс, отвечающий за построение дорожной сети.
     """
 
-    def __init__(self, grid: Grid):
+    def __init__(self, grid: Grid, n_workers: int = None, time_budget: float = None):
+        """
+
+        :param grid:
+        :param n_workers: Число процессов для оценки точек Штейнера. При значении 1 оценка выполняется последовательно.
+        :param time_budget: Ограничение времени построения MST в секундах. По умолчанию configs.BUILDER_TIME_BUDGET,
+        None - без ограничения.
+        """
 
         self.grid = grid
+        self.n_workers = configs.N_WORKERS if n_workers is None else n_workers
+        self.time_budget = configs.BUILDER_TIME_BUDGET if time_budget is None else time_budget
+        self._evaluator = None
+        self._candidates_memo = dict()
+        self.stats = dict()
+        self.best_mst = None
+        self.best_cost = None
 
         self._choose_steiner_points()
 
     def _choose_steiner_points(self):
         """
-        Выбор 'точек Штейнера'
+        Выбор начальных 'точек Штейнера': положения utils.compute_steiner_candidate_points, привязанные к сетке. Вокруг
+        этих же положений сгущается многоуровневая сетка.
+
+        :return:
+        """
+
+        self.steiner_indices = np.array([], dtype=np.int64)
+        self._snap_steiner_points(utils.compute_steiner_candidate_points(self.grid.terminal_points))
+
+    def _refine_steiner_points(self, steiner_point_ind: int, mst: Graph):
+        """
+        Добавление 'точек Штейнера' вокруг принятой точки: точки Ферма треугольников из принятой точки и ее соседей
+        в MST.
+
+        :param steiner_point_ind:
+        :param mst:
+        :return:
+        """
+
+        if configs.STEINER_POINTS_GENERATOR != "fermat":
+            return
+
+        vertices = [steiner_point_ind] + list(mst.neighbors(steiner_point_ind))
+        triangles = [self.grid.points[list(triple)] for triple in combinations(vertices, 3)]
+        if not triangles:
+            return
+
+        fermat_points, savings = utils.compute_fermat_points(np.array(triangles))
+        self._add_steiner_points(fermat_points, savings, configs.N_REFINED_STEINER_CANDIDATES)
+
+    def _add_steiner_points(self, points: np.ndarray, savings: np.ndarray, budget: int):
+        """
+        Привязка точек к сетке и добавление не более budget новых 'точек Штейнера' с наибольшим выигрышем.
+
+        :param points:
+        :param savings:
+        :param budget:
+        :return:
+        """
+
+        order = np.argsort(-savings, kind="stable")
+        order = order[savings[order] > 0]
+
+        self._snap_steiner_points(points[order], budget)
+
+    def _snap_steiner_points(self, points: np.ndarray, budget: int = None):
+        """
+        Привязка точек к сетке и добавление их в порядке следования как новых 'точек Штейнера'. Точки, попавшие в
+        терминальные или уже выбранные вершины, пропускаются.
 
+        :param points:
+        :param budget: Наибольшее число добавляемых точек. По умолчанию не ограничено.
         :return:
         """
 
-        x = np.linspace(self.grid.lower_left[0], self.grid.upper_right[0], int(np.sqrt(configs.N_STEINER_POINTS)))
-        y = np.linspace(self.grid.lower_left[1], self.grid.upper_right[1], int(np.sqrt(configs.N_STEINER_POINTS)))
+        if len(points) == 0:
+            return
 
-        xv, yv = np.meshgrid(x, y)
+        _, indices = self.grid.kd_tree.query(points, k=1)
 
-        steiner_points = np.vstack((xv.flatten(), yv.flatten())).T
-        _, steiner_indices = self.grid.kd_tree.query(steiner_points, k=1)
+        known_indices = set(self.steiner_indices.tolist())
+        new_indices = list()
+        for ind in indices.flatten().tolist():
+            if len(new_indices) == budget:
+                break
+            if ind < len(self.grid.terminal_points) or ind in known_indices:
+                continue
+
+            known_indices.add(ind)
+            new_indices.append(ind)
 
-        self.steiner_indices = steiner_indices.flatten()
+        self.steiner_indices = np.concatenate((self.steiner_indices, np.array(new_indices, dtype=np.int64)))
+        self.grid.add_sources(new_indices)
 
     def _create_initial_graph(self):
         """
@@ -46,66 +134,324 @@ class NetworkBuilder:
         :return:
         """
 
-        graph = nx.Graph()
-        for ind, point in enumerate(self.grid.terminal_points):
-            graph.add_node(ind, point=point)
+        return CompleteGraph(self.grid, range(len(self.grid.terminal_points)))
+
+    def _get_evaluator(self, graph: CompleteGraph) -> CandidateEvaluator:
+        """
+        Оценщик точек Штейнера для графа. Пересоздается, когда меняется набор вершин графа.
+
+        :param graph:
+        :return:
+        """
+
+        if self._evaluator is None or self._evaluator.vertices != set(graph.nodes):
+            self._evaluator = CandidateEvaluator(self.grid, graph)
 
-        for ind1 in range(len(self.grid.terminal_points)):
-            for ind2 in range(ind1 + 1, len(self.grid.terminal_points)):
-                graph.add_edge(ind1, ind2, length=self.grid.distance_matrix[ind1, ind2])
+        return self._evaluator
 
-        return graph
+    def _evaluate_candidate(self, graph: CompleteGraph, steiner_point_ind: int):
+        """
+        Стоимость MST графа, дополненного точкой Штейнера.
+
+        :param graph:
+        :param steiner_point_ind:
+        :return:
+        """
+
+        return self._get_evaluator(graph).evaluate(steiner_point_ind)
+
+    def _evaluate_candidates(self, graph: CompleteGraph, candidates, executor=None, get_threshold=lambda: None):
+        """
+        Оценка точек Штейнера. Результаты возвращаются в порядке кандидатов, независимо от числа процессов.
 
+        :param graph:
+        :param candidates:
+        :param executor:
+        :param get_threshold: Функция, возвращающая текущую лучшую стоимость. Кандидаты, нижняя оценка стоимости
+        которых больше нее, не оцениваются, и для них возвращается None.
+        :return:
+        """
+
+        evaluator = self._get_evaluator(graph)
+
+        if executor is None:
+            for candidate in candidates:
+                if self._is_pruned(evaluator, candidate, get_threshold()):
+                    yield None
+                else:
+                    yield evaluator.evaluate(candidate)
+        else:
+            # Кандидаты отправляются частями, чтобы между частями обновлялся порог и можно было прервать оценку.
+            chunk_size = 2 * self.n_workers
+            for start in range(0, len(candidates), chunk_size):
+                chunk = candidates[start:start + chunk_size]
+                threshold = get_threshold()
+                is_pruned = [self._is_pruned(evaluator, candidate, threshold) for candidate in chunk]
+                vertices = tuple(graph.nodes)
+                tasks = [(vertices, candidate) for candidate, pruned in zip(chunk, is_pruned) if not pruned]
+                results = executor.map(_evaluate_candidate_in_worker, tasks)
+                for pruned in is_pruned:
+                    yield None if pruned else next(results)
+
+    def _order_candidates(self, graph: CompleteGraph, candidates):
+        """
+        Упорядочивание точек Штейнера по возрастанию нижней оценки стоимости, чтобы при ограничении времени сначала
+        оценивались самые перспективные.
+
+        :param graph:
+        :param candidates:
+        :return:
+        """
+
+        evaluator = self._get_evaluator(graph)
+
+        return sorted(candidates, key=evaluator.lower_bound)
+
+    def _is_pruned(self, evaluator: CandidateEvaluator, candidate: int, threshold: float) -> bool:
+        """
+        Можно ли не оценивать точку Штейнера: нижняя оценка ее стоимости больше порога или, при
+        configs.MEMOIZE_CANDIDATES, стоимость, оцененная по сохраненному результату прошлых раундов, не меньше порога.
+
+        :param evaluator:
+        :param candidate:
+        :param threshold:
+        :return:
+        """
+
+        if threshold is None:
+            return False
+
+        if configs.PRUNE_CANDIDATES:
+            lower_bound = evaluator.lower_bound(candidate)
+            if lower_bound > threshold and not np.isclose(lower_bound, threshold):
+                self.stats["pruned_candidates"] += 1
+                return True
+
+        memo = self._candidates_memo.get(candidate)
+        if memo is not None:
+            estimated_cost = evaluator.cost + memo[0]
+            if estimated_cost > threshold or np.isclose(estimated_cost, threshold):
+                self.stats["reused_candidates"] += 1
+                return True
+
+        return False
+
+    def _memoize_candidate(self, evaluator: CandidateEvaluator, candidate: int, cost: float, mst: Graph):
+        """
+        Сохранение результата оценки точки Штейнера: изменение стоимости MST и соседи точки в MST.
+
+        :param evaluator:
+        :param candidate:
+        :param cost:
+        :param mst:
+        :return:
+        """
+
+        if not configs.MEMOIZE_CANDIDATES or mst is None:
+            return
+
+        self._candidates_memo[candidate] = (cost - evaluator.cost, frozenset(mst.neighbors(candidate)))
+
+    def _invalidate_candidates_memo(self, old_evaluator: CandidateEvaluator, new_evaluator: CandidateEvaluator):
+        """
+        Удаление сохраненных оценок точек Штейнера, окрестность которых затронута изменением графа.
+
+        Затронутыми считаются новые вершины и их соседи в MST, вершины, у которых изменились расстояния до карьеров, и
+        концы ребер, у которых изменились стоимость или прикрепленные карьеры. Если объем какого-либо карьера
+        исчерпан, стоимости ребер зависят друг от друга через объемы, и удаляются все оценки.
+
+        :param old_evaluator:
+        :param new_evaluator:
+        :return:
+        """
+
+        if not new_evaluator.is_incremental:
+            self._candidates_memo.clear()
+            return
+
+        new_vertices = new_evaluator.vertices - old_evaluator.vertices
+        affected_vertices = set(new_vertices)
+        for vertex in new_vertices:
+            affected_vertices.update(new_evaluator.mst.neighbors(vertex))
+
+        for vertex, distances in old_evaluator.distances.items():
+            if new_evaluator.distances.get(vertex) != distances:
+                affected_vertices.add(vertex)
+
+        for key, cost in old_evaluator.costs.items():
+            if not np.isclose(new_evaluator.costs.get(key, np.inf), cost) or \
+                    new_evaluator.volumes.get(key) != old_evaluator.volumes.get(key):
+                affected_vertices.update(key)
+
+        for candidate, (_, neighbours) in list(self._candidates_memo.items()):
+            if candidate in new_vertices or not affected_vertices.isdisjoint(neighbours):
+                del self._candidates_memo[candidate]
+
+    @staticmethod
+    def _choose_batch(improving_candidates, budget: int):
+        """
+        Выбор невзаимодействующих улучшающих точек Штейнера в порядке возрастания стоимости. Точки считаются
+        невзаимодействующими, если у них нет общих соседей в своих MST, то есть они перестраивают разные ребра.
+
+        :param improving_candidates: Список (стоимость, точка, MST).
+        :param budget: Максимальное число точек.
+        :return: Список выбранных точек.
+        """
+
+        batch = list()
+        touched_vertices = set()
+        for _, candidate, mst in sorted(improving_candidates, key=lambda item: item[0]):
+            if len(batch) == min(budget, configs.N_BATCH_STEINER_POINTS):
+                break
+
+            neighbours = set(mst.neighbors(candidate))
+            if touched_vertices.isdisjoint(neighbours):
+                batch.append(candidate)
+                touched_vertices.update(neighbours)
+
+        return batch
+
+    def _accept_batch(self, graph: CompleteGraph, batch, best_single_cost: float):
+        """
+        Добавление группы точек Штейнера в граф с одной проверкой. Группа принимается, если MST с ней не дороже,
+        чем с лучшей одиночной точкой. Иначе граф возвращается в исходное состояние.
+
+        :param graph:
+        :param batch:
+        :param best_single_cost:
+        :return: MST и его стоимость или None, если группа не принята.
+        """
+
+        if len(batch) < 2:
+            return None
+
+        for candidate in batch:
+            graph.add_node(candidate)
+
+        try:
+            evaluator = self._get_evaluator(graph)
+            if evaluator.cost < best_single_cost or np.isclose(evaluator.cost, best_single_cost):
+                return evaluator.mst, evaluator.cost
+        except ValueError:
+            pass
+
+        graph.remove_nodes_from(batch)
+        self.stats["rejected_batches"] += 1
+        return None
+
+    @instrumentation.timed()
     def _build_mst(self):
         """
         Построение оптимального MST.
 
         :return:
         """
+        executor = None
+        if self.n_workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker, initargs=(self,))
+
+        try:
+            return self._build_mst_with_executor(executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _build_mst_with_executor(self, executor):
+        """
+        Жадное добавление точек Штейнера.
+
+        При заданном ограничении времени кандидаты оцениваются в порядке возрастания нижней оценки стоимости. Когда
+        время истекает, принимается лучшая из уже оцененных улучшающих точек и возвращается текущий MST. Лучший
+        найденный MST и его стоимость в любой момент доступны в best_mst и best_cost.
+
+        :param executor: Пул процессов или None для последовательной оценки.
+        :return:
+        """
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        self.stats = {"evaluated_candidates": 0, "pruned_candidates": 0, "reused_candidates": 0, "rounds": 0,
+                      "accepted_points": 0, "rejected_batches": 0, "timed_out": False}
+        self._candidates_memo = dict()
+
         optimal_graph = self._create_initial_graph()
 
-        network = self.grid.create_network(optimal_graph)
-        splitter = EdgesSplitter(network)
-        splitter.calculate()
-        utils.assign_quarries_costs(network, optimal_graph)
+        evaluator = self._get_evaluator(optimal_graph)
+        optimal_mst = evaluator.mst
+        optimal_cost = evaluator.cost
+        self.best_mst, self.best_cost = optimal_mst, optimal_cost
+
+        n_accepted = 0
+        while n_accepted < configs.N_STEINER_POINTS:
+            if deadline is not None and time.perf_counter() >= deadline:
+                self.stats["timed_out"] = True
+                break
+
+            self.stats["rounds"] += 1
+            previous_evaluator, evaluator = evaluator, self._get_evaluator(optimal_graph)
+            if evaluator is not previous_evaluator:
+                self._invalidate_candidates_memo(previous_evaluator, evaluator)
 
-        optimal_mst = nx.minimum_spanning_tree(optimal_graph, weight=COST_TO_USE)
-        optimal_cost = optimal_mst.size(weight=COST_TO_USE)
+            candidates = [ind for ind in self.steiner_indices if ind not in optimal_graph]
+            if deadline is not None:
+                candidates = self._order_candidates(optimal_graph, candidates)
 
-        for _ in range(configs.N_STEINER_POINTS):
             min_current_cost = None
             min_current_mst = None
-            min_current_graph = None
-            for steiner_point_ind in self.steiner_indices:
-                if steiner_point_ind in optimal_graph.nodes:
-                    continue
-
-                current_graph = copy.deepcopy(optimal_graph)
-                current_graph.add_node(steiner_point_ind)
-                for ind, distance in enumerate(self.grid.distance_matrix[steiner_point_ind]):
-                    if ind in current_graph.nodes and not np.isclose(distance, 0):
-                        current_graph.add_edge(steiner_point_ind, ind, length=distance)
-
-                network = self.grid.create_network(current_graph)
-                splitter = EdgesSplitter(network)
-                splitter.calculate()
-                utils.assign_quarries_costs(network, current_graph)
-
-                current_mst = nx.minimum_spanning_tree(current_graph, weight=COST_TO_USE)
-                current_cost = current_mst.size(weight=COST_TO_USE)
-                if min_current_cost is None or current_cost < min_current_cost:
-                    min_current_cost = current_cost
-                    min_current_mst = current_mst
-                    min_current_graph = current_graph
-
-            if min_current_cost >= optimal_cost:
+            min_current_candidate = None
+            improving_candidates = list()
+            def get_threshold():
+                if configs.N_BATCH_STEINER_POINTS > 1 or min_current_cost is None:
+                    return optimal_cost
+                return min(optimal_cost, min_current_cost)
+
+            with instrumentation.timer("NetworkBuilder.round"):
+                results = self._evaluate_candidates(optimal_graph, candidates, executor, get_threshold)
+                for candidate, result in zip(candidates, results):
+                    if result is None:
+                        continue
+
+                    self.stats["evaluated_candidates"] += 1
+                    current_cost, current_mst = result
+                    self._memoize_candidate(evaluator, candidate, current_cost, current_mst)
+                    if current_cost < optimal_cost:
+                        improving_candidates.append((current_cost, candidate, current_mst))
+                    if min_current_cost is None or current_cost < min_current_cost:
+                        min_current_cost = current_cost
+                        min_current_mst = current_mst
+                        min_current_candidate = candidate
+
+                    if deadline is not None and time.perf_counter() >= deadline:
+                        self.stats["timed_out"] = True
+                        break
+
+            if min_current_cost is None or min_current_cost >= optimal_cost:
                 break
-            else:
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                self.stats["timed_out"] = True
+
+            # Проверка группы строит новый оценщик, поэтому после истечения времени принимается лучшая одиночная точка.
+            accepted = None
+            if not self.stats["timed_out"]:
+                batch = self._choose_batch(improving_candidates, configs.N_STEINER_POINTS - n_accepted)
+                accepted = self._accept_batch(optimal_graph, batch, min_current_cost)
+            if accepted is None:
                 optimal_cost = min_current_cost
                 optimal_mst = min_current_mst
-                optimal_graph = min_current_graph
+                accepted = [min_current_candidate]
+                optimal_graph.add_node(min_current_candidate)
+            else:
+                optimal_mst, optimal_cost = accepted
+                accepted = batch
+
+            n_accepted += len(accepted)
+            self.stats["accepted_points"] += len(accepted)
+            self.best_mst, self.best_cost = optimal_mst, optimal_cost
+            if self.stats["timed_out"]:
+                break
+
+            for candidate in accepted:
+                self._refine_steiner_points(candidate, optimal_mst)
 
-        print(optimal_cost)
         return optimal_mst, optimal_cost
 
     def build_network(self):
@@ -2,7 +2,10 @@
 Модуль, отвечающий за отрисовку дорожной сети.
 """
 
+from pathlib import Path
+
 from matplotlib import pyplot as plt
+from scipy.sparse import coo_matrix
 
 from grid import Grid
 from network import Network
@@ -10,11 +13,12 @@ import numpy as np
 from utils import edge_key
 
 
-def draw_raw_road_network(road_network: Network):
+def draw_raw_road_network(road_network: Network, path: Path = None):
     """
     Отрисовка дорожной сети до вычисления ближайших карьеров.
 
     :param road_network:
+    :param path: Файл для сохранения рисунка. Если не задан, рисунок показывается на экране.
     :return:
     """
 
@@ -41,21 +45,22 @@ def draw_raw_road_network(road_network: Network):
     for line in road_network.edge_to_line_mapping.values():
         plt.plot(line.coords.xy[0], line.coords.xy[1], color=other_color, zorder=1)
 
-    plt.show()
+    _show_or_save(path)
 
 
-def draw_calculated_road_network(road_network: Network):
+def draw_calculated_road_network(road_network: Network, path: Path = None):
     """
     Отрисовка дорожной сети до вычисления ближайших карьеров.
 
     :param road_network:
+    :param path: Файл для сохранения рисунка. Если не задан, рисунок показывается на экране.
     :return:
     """
 
     ordered_quarries = list(road_network.quarries)
     quarry_to_ind_mapping = {quarry: ind for ind, quarry in enumerate(ordered_quarries)}
 
-    quarries_color_map = plt.cm.get_cmap("plasma", len(ordered_quarries))
+    quarries_color_map = plt.get_cmap("plasma", len(ordered_quarries))
     other_color = "black"
 
     for vertex in road_network.usual_vertices:
@@ -79,7 +84,22 @@ def draw_calculated_road_network(road_network: Network):
         attached_quarry = road_network.edge_attached_quarry[edge_key(u, v)]
         plt.plot(line.coords.xy[0], line.coords.xy[1], zorder=1, color=quarries_color_map(quarry_to_ind_mapping[attached_quarry]))
 
-    plt.show()
+    _show_or_save(path)
+
+
+def _show_or_save(path: Path = None):
+    """
+    Показ текущего рисунка или его сохранение в файл.
+
+    :param path:
+    :return:
+    """
+
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
 
 
 def draw_grid(grid: Grid):
@@ -90,11 +110,11 @@ def draw_grid(grid: Grid):
     :return:
     """
     fig, axes = plt.subplots()
-    for ind1 in range(len(grid.points)):
-        for ind2 in range(len(grid.points)):
-            if not np.isclose(grid.connectivity_matrix[ind1, ind2], 0):
-                points = np.vstack((grid.points[ind1], grid.points[ind2]))
-                axes.plot(points[:, 0], points[:, 1], 'k-', color='black')
+    connectivity_matrix = coo_matrix(grid.connectivity_matrix)
+    for ind1, ind2, length in zip(connectivity_matrix.row, connectivity_matrix.col, connectivity_matrix.data):
+        if ind1 < ind2 and not np.isclose(length, 0):
+            points = np.vstack((grid.points[ind1], grid.points[ind2]))
+            axes.plot(points[:, 0], points[:, 1], 'k-', color='black')
 
     for point in grid.points[len(grid.terminal_points):]:
         axes.plot(point[0], point[1], 'o', color='black')
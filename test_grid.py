@@ -0,0 +1,36 @@
+"""
+Проверки сетки.
+"""
+
+import numpy as np
+import pytest
+
+import configs
+from grid import Grid
+
+
+@pytest.mark.parametrize("sampling", ["uniform", "adaptive"])
+def test_grid_has_no_isolated_vertices(monkeypatch, sampling):
+    monkeypatch.setattr(configs, "GRID_SAMPLING", sampling)
+    monkeypatch.setattr(configs, "GRID_CACHE_DIR", None)
+
+    terminal_points = np.random.RandomState(0).uniform(0, 1000, size=(12, 2))
+    grid = Grid(terminal_points, {10, 11}, seed=2)
+    grid.generate()
+
+    degrees = np.asarray((grid.connectivity_matrix != 0).sum(axis=1)).ravel()
+    assert np.all(degrees > 0)
+    assert len(grid.points) <= len(terminal_points) + configs.GRID_SIZE
+
+
+def test_adaptive_grid_with_points_of_interest_outside_site(monkeypatch):
+    monkeypatch.setattr(configs, "GRID_SAMPLING", "adaptive")
+    monkeypatch.setattr(configs, "GRID_CACHE_DIR", None)
+
+    terminal_points = np.random.RandomState(0).uniform(0, 10, size=(12, 2))
+    grid = Grid(terminal_points, {10, 11}, seed=2, points_of_interest=[[100, 100]])
+    grid.generate()
+
+    indent = configs.BOUNDARY_INDENT
+    assert np.all(grid.points >= terminal_points.min(axis=0) - indent)
+    assert np.all(grid.points <= terminal_points.max(axis=0) + indent)
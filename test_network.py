@@ -0,0 +1,88 @@
+"""
+Проверки сети.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+
+import utils
+from edges_splitter import EdgesSplitter
+from network import Network
+from utils import edge_key
+
+INPUT_PATH = Path(__file__).parent / "input.txt"
+
+
+def create_path_network():
+    """
+    Путь 0 - 1 - 2 с карьером в вершине 2.
+
+    :return:
+    """
+    return Network(vertices=[0, 1, 2], quarry_capacities={2: 100.0},
+                   incidence_list=[(0, 1, LineString([(0, 0), (1, 0)])), (1, 2, LineString([(1, 0), (3, 0)]))])
+
+
+def compute_cost(network: Network) -> float:
+    splitter = EdgesSplitter(network, keep_old_road_network=False)
+    splitter.calculate()
+
+    return utils.compute_road_network_cost(splitter.road_network)
+
+
+def test_views_match_dicts():
+    network = create_path_network()
+    network.compute_distances_to_quarries()
+
+    assert dict(network.first_poit_vertex) == {edge_key(0, 1): 0, edge_key(1, 2): 1}
+    assert dict(network.last_point_vertex) == {edge_key(0, 1): 1, edge_key(1, 2): 2}
+    assert dict(network.original_edge) == {edge_key(0, 1): edge_key(0, 1), edge_key(1, 2): edge_key(1, 2)}
+    assert {key: line.length for key, line in network.edge_to_line_mapping.items()} == \
+        {edge_key(0, 1): 1.0, edge_key(1, 2): 2.0}
+    assert {vertex: dict(distances) for vertex, distances in network.distances_to_quarries.items()} == \
+        {0: {2: 3.0}, 1: {2: 2.0}, 2: {2: 0.0}}
+    assert dict(network.second_vertex_in_path[0]) == {2: 1}
+
+    _, new_vertex, _ = network.split_edge(1, 2, 0.5)
+    assert set(network.edge_to_line_mapping) == {edge_key(0, 1), edge_key(1, new_vertex), edge_key(new_vertex, 2)}
+    assert network.original_edge[edge_key(new_vertex, 2)] == edge_key(1, 2)
+    assert network.distances_to_quarries[new_vertex][2] == pytest.approx(1.5)
+
+
+def test_path_network_cost():
+    assert compute_cost(create_path_network()) == pytest.approx(4.5)
+
+
+def test_from_arrays_matches_incidence_list():
+    network = create_path_network()
+    arrays_network = Network.from_arrays(vertices=[0, 1, 2], quarry_capacities={2: 100.0}, edges=[(0, 1), (1, 2)],
+                                         coords=[(0, 0), (1, 0), (1, 0), (3, 0)], offsets=[0, 2, 4])
+
+    assert dict(arrays_network.vertex_to_point_mapping) == dict(network.vertex_to_point_mapping)
+    assert compute_cost(arrays_network) == pytest.approx(compute_cost(network))
+
+
+def test_binary_file_round_trip(tmp_path):
+    network = Network.read_from_file(INPUT_PATH)
+    path = tmp_path / "network.npz"
+    network.write_to_binary_file(path)
+    loaded_network = Network.read_from_file(path)
+
+    assert dict(loaded_network.quarries_capacities) == dict(network.quarries_capacities)
+    assert set(loaded_network.edge_to_line_mapping) == set(network.edge_to_line_mapping)
+    for key, line in network.edge_to_line_mapping.items():
+        assert np.allclose(loaded_network.edge_to_line_mapping[key].coords, line.coords)
+    assert compute_cost(loaded_network) == pytest.approx(compute_cost(network))
+
+
+def test_edge_endpoints_missing_from_vertices_are_added():
+    incidence_list = [(0, 1, LineString([(0, 0), (3, 0)])), (1, 2, LineString([(3, 0), (6, 0)]))]
+    network = Network(vertices=[1, 2], quarry_capacities={1: 100.0}, incidence_list=incidence_list)
+    arrays_network = Network.from_arrays(vertices=[1, 2], quarry_capacities={1: 100.0}, edges=[(0, 1), (1, 2)],
+                                         coords=[(0, 0), (3, 0), (3, 0), (6, 0)], offsets=[0, 2, 4])
+
+    assert compute_cost(network) == pytest.approx(9.0)
+    assert compute_cost(arrays_network) == pytest.approx(9.0)
@@ -0,0 +1,64 @@
+"""
+Проверки эквивалентности режимов построения MST.
+"""
+
+import numpy as np
+import pytest
+
+import configs
+from grid import Grid
+from network_builder import NetworkBuilder
+
+
+@pytest.fixture
+def grid(monkeypatch):
+    monkeypatch.setattr(configs, "GRID_SIZE", 300)
+    monkeypatch.setattr(configs, "GRID_CACHE_DIR", None)
+    monkeypatch.setattr(configs, "N_STEINER_POINTS", 16)
+
+    random_state = np.random.RandomState(2)
+    points = random_state.uniform(0, 2, size=(11, 2))
+    grid = Grid(points, {8, 9, 10}, seed=1)
+    grid.generate()
+
+    return grid
+
+
+def build_mst(grid: Grid, n_workers: int = 1):
+    mst, cost = NetworkBuilder(grid, n_workers=n_workers)._build_mst()
+
+    return cost, sorted(tuple(sorted(edge)) for edge in mst.edges)
+
+
+@pytest.mark.parametrize("name, value", [("INCREMENTAL_EVALUATION", False), ("PRUNE_CANDIDATES", False),
+                                         ("MEMOIZE_CANDIDATES", True)])
+def test_evaluation_modes_give_same_mst(monkeypatch, grid, name, value):
+    expected_cost, expected_edges = build_mst(grid)
+    # На этой задаче принимаются точки Штейнера, и MST содержит больше ребер, чем дерево на терминальных вершинах.
+    assert len(expected_edges) > len(grid.terminal_points) - 1
+
+    monkeypatch.setattr(configs, name, value)
+    cost, edges = build_mst(grid)
+
+    assert np.isclose(cost, expected_cost)
+    assert edges == expected_edges
+
+
+def test_process_pool_gives_same_mst(grid):
+    expected_cost, expected_edges = build_mst(grid)
+    cost, edges = build_mst(grid, n_workers=2)
+
+    assert np.isclose(cost, expected_cost)
+    assert edges == expected_edges
+
+
+def test_cached_grid_gives_same_mst(grid, tmp_path):
+    expected_cost, expected_edges = build_mst(grid)
+
+    grid.save(tmp_path / "grid")
+    loaded_grid = Grid(grid.terminal_points, grid.quarries_indices, seed=grid.seed)
+    loaded_grid.load(tmp_path / "grid")
+    cost, edges = build_mst(loaded_grid)
+
+    assert np.isclose(cost, expected_cost)
+    assert edges == expected_edges
@@ -1,15 +1,15 @@
 """
 Полезные функции.
 """
-from collections import defaultdict
 from pathlib import Path
 from typing import FrozenSet
 
 import numpy as np
+from scipy.spatial import Delaunay, QhullError
 from shapely.geometry import LineString, Point
 
 import configs
-import networkx as nx
+import instrumentation
 
 
 def split_line_string_by_point(line_string: LineString, point: Point):
@@ -26,18 +26,80 @@ def split_line_string_by_point(line_string: LineString, point: Point):
     if distance <= 0.0 or distance >= line_string.length:
         return [LineString(line_string)]
 
-    coords = list(line_string.coords)
-    for i, p in enumerate(coords):
-        pd = line_string.project(Point(p))
-        if pd == distance:
-            return [
-                LineString(coords[:i + 1]),
-                LineString(coords[i:])]
-        if pd > distance:
-            cp = line_string.interpolate(distance)
-            return [
-                LineString(coords[:i] + [(cp.x, cp.y)]),
-                LineString([(cp.x, cp.y)] + coords[i:])]
+    start_line, end_line, _, _ = split_line_string_by_distance(line_string, distance)
+
+    return [start_line, end_line]
+
+
+def split_line_string_by_distance(line_string: LineString, distance: float, from_end: bool = False):
+    """
+    Разбиение LineString на две части в точке на заданном расстоянии от начала ломаной.
+
+    :param line_string:
+    :param distance: Расстояние вдоль ломаной, 0 < distance < line_string.length.
+    :param from_end: Отсчитывать расстояние от конца ломаной. Обе части при этом направлены от конца к началу.
+    :return: Первая часть, вторая часть, длина первой части, длина второй части.
+    """
+
+    start_coords, end_coords, start_cumulative_lengths, end_cumulative_lengths = split_coords_by_distance(
+        np.asarray(line_string.coords), distance, from_end=from_end)
+
+    return (LineString(start_coords), LineString(end_coords), start_cumulative_lengths[-1],
+            end_cumulative_lengths[-1])
+
+
+def compute_cumulative_lengths(coords: np.ndarray) -> np.ndarray:
+    """
+    Накопленные длины отрезков ломаной: элемент i - длина ломаной от первой точки до точки i.
+
+    :param coords: Массив формы (n_points, 2).
+    :return:
+    """
+
+    return np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(coords[:, :2], axis=0).T))))
+
+
+def split_coords_by_distance(coords: np.ndarray, distance: float, cumulative_lengths: np.ndarray = None,
+                             from_end: bool = False):
+    """
+    Разбиение ломаной, заданной массивом координат, в точке на заданном расстоянии от начала.
+
+    Отрезок с точкой разбиения находится бинарным поиском по накопленным длинам отрезков, поэтому при известных
+    накопленных длинах разбиение сводится к поиску и копированию двух частей массива.
+
+    :param coords: Массив формы (n_points, 2).
+    :param distance: Расстояние вдоль ломаной, 0 < distance < длина ломаной.
+    :param cumulative_lengths: Накопленные длины отрезков ломаной, см. compute_cumulative_lengths. По умолчанию
+    вычисляются по координатам.
+    :param from_end: Отсчитывать расстояние от конца ломаной. Обе части при этом направлены от конца к началу.
+    :return: Координаты первой части, координаты второй части, накопленные длины отрезков первой части, накопленные
+    длины отрезков второй части. Последние элементы накопленных длин - длины частей.
+    """
+
+    if cumulative_lengths is None:
+        cumulative_lengths = compute_cumulative_lengths(coords)
+
+    if from_end:
+        coords = coords[::-1]
+        cumulative_lengths = cumulative_lengths[-1] - cumulative_lengths[::-1]
+
+    ind = int(np.searchsorted(cumulative_lengths, distance, side="right")) - 1
+    ind = min(max(ind, 0), len(coords) - 2)
+
+    if distance == cumulative_lengths[ind]:
+        start_coords = coords[:ind + 1]
+        end_coords = coords[ind:]
+        start_cumulative_lengths = cumulative_lengths[:ind + 1]
+        end_cumulative_lengths = cumulative_lengths[ind:] - distance
+    else:
+        coeff = (distance - cumulative_lengths[ind]) / (cumulative_lengths[ind + 1] - cumulative_lengths[ind])
+        point = coords[ind] + coeff * (coords[ind + 1] - coords[ind])
+        start_coords = np.vstack((coords[:ind + 1], point))
+        end_coords = np.vstack((point, coords[ind + 1:]))
+        start_cumulative_lengths = np.append(cumulative_lengths[:ind + 1], distance)
+        end_cumulative_lengths = np.concatenate(([0.0], cumulative_lengths[ind + 1:] - distance))
+
+    return start_coords, end_coords, start_cumulative_lengths, end_cumulative_lengths
 
 
 def compute_required_volume(line: LineString):
@@ -87,31 +149,56 @@ def compute_road_network_cost(road_network: "Network"):
     :return:
     """
 
-    total_cost = 0
-    for (u, v), line in road_network.edge_to_line_mapping.items():
-        attached_quarry = road_network.edge_attached_quarry[edge_key(u, v)]
-        distance_to_quarry = min(road_network.distances_to_quarries[u][attached_quarry], road_network.distances_to_quarries[v][attached_quarry])
-
-        total_cost += compute_line_cost(line, distance_to_quarry)
+    total_cost, _ = compute_network_costs(road_network)
 
     return total_cost
 
 
-def assign_quarries_costs(road_network: "Network", original_graph: nx.Graph):
+def compute_quarries_costs(road_network: "Network"):
     """
-    Подсчет стоимости дорожной сети.
+    Подсчет стоимости каждого исходного ребра дорожной сети.
 
     :param road_network:
-    :return:
+    :return: Словарь: ключ исходного ребра -> стоимость.
     """
-    quarries_costs = defaultdict(lambda: 0)
-    for (u, v), line in road_network.edge_to_line_mapping.items():
-        attached_quarry = road_network.edge_attached_quarry[edge_key(u, v)]
-        distance_to_quarry = min(road_network.distances_to_quarries[u][attached_quarry], road_network.distances_to_quarries[v][attached_quarry])
 
-        quarries_costs[road_network.original_edge[edge_key(u, v)]] += compute_line_cost(line, distance_to_quarry)
+    _, quarries_costs = compute_network_costs(road_network)
+
+    return quarries_costs
+
+
+@instrumentation.timed()
+def compute_network_costs(road_network: "Network"):
+    """
+    Подсчет стоимости дорожной сети и каждого ее исходного ребра.
+
+    Стоимости всех ребер вычисляются одним выражением по массивам длин и расстояний до прикрепленных карьеров,
+    после чего суммируются по исходным ребрам с помощью np.bincount.
+
+    :param road_network:
+    :return: Общая стоимость и словарь: ключ исходного ребра -> стоимость.
+    """
+
+    edge_ids = road_network.alive_edges()
+    attached_quarries = road_network.edge_quarry[edge_ids]
+    if np.any(attached_quarries < 0):
+        raise ValueError("Не для всех ребер выбран карьер.")
+
+    columns = road_network.columns_of(attached_quarries)
+    first_distances = road_network.quarry_distances[road_network.rows_of(road_network.edge_first[edge_ids]), columns]
+    last_distances = road_network.quarry_distances[road_network.rows_of(road_network.edge_last[edge_ids]), columns]
 
-    nx.set_edge_attributes(original_graph, quarries_costs, name="quarry_cost")
+    costs = compute_lines_costs(road_network.edge_length[edge_ids], np.minimum(first_distances, last_distances))
+
+    original_edge_ids = road_network.edge_original[edge_ids]
+    original_costs = np.bincount(original_edge_ids, weights=costs, minlength=road_network.n_edges)
+
+    quarries_costs = dict()
+    for original_edge_id in np.unique(original_edge_ids):
+        key = edge_key(int(road_network.edge_first[original_edge_id]), int(road_network.edge_last[original_edge_id]))
+        quarries_costs[key] = original_costs[original_edge_id]
+
+    return float(np.sum(costs)), quarries_costs
 
 
 def compute_line_cost(line: LineString, distance_to_quarry: float):
@@ -122,12 +209,154 @@ def compute_line_cost(line: LineString, distance_to_quarry: float):
     :param distance_to_quarry:
     :return:
     """
-    length = line.length
+    return compute_lines_costs(line.length, distance_to_quarry)
+
+
+def compute_lines_lengths(coords: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Длины ломаных, координаты которых записаны подряд в одном массиве.
+
+    :param coords: Координаты всех ломаных, массив (n_points, 2).
+    :param offsets: Смещения ломаных, массив длины n_lines + 1. Ломаная i - coords[offsets[i]:offsets[i + 1]].
+    :return:
+    """
+    if len(offsets) < 2:
+        return np.zeros(0)
+
+    # Отрезки между соседними ломаными не учитываются.
+    segment_lengths = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+    segment_lengths[offsets[1:-1] - 1] = 0
+
+    return np.add.reduceat(segment_lengths, offsets[:-1])
+
+
+def compute_lines_costs(lengths, distances_to_quarry):
+    """
+    Подсчет стоимости ребер по их длинам и расстояниям до карьеров. Работает как с числами, так и с массивами.
+
+    :param lengths:
+    :param distances_to_quarry:
+    :return:
+    """
 
     coeff = configs.ROAD_HEIGHT * configs.ROAD_WIDTH * configs.UNIT_COST
-    value = length * distance_to_quarry + length ** 2 / 2
+    values = lengths * distances_to_quarry + lengths ** 2 / 2
+
+    return coeff * values
+
+
+def compute_lines_costs_lower_bound(lengths, first_distances, last_distances):
+    """
+    Нижняя оценка стоимости ребер.
+
+    Стоимость ребра равна интегралу по ребру расстояния до прикрепленного карьера, а расстояние от точки ребра до
+    любого карьера не меньше min(first_distance + x, last_distance + length - x), где first_distance и
+    last_distance - нижние оценки расстояний от концов ребра до ближайшего карьера.
+
+    :param lengths:
+    :param first_distances:
+    :param last_distances:
+    :return:
+    """
+
+    lengths = np.asarray(lengths, dtype=float)
+    crossing = np.clip((last_distances + lengths - first_distances) / 2, 0, lengths)
+
+    first_part = first_distances * crossing + crossing ** 2 / 2
+    last_part = (last_distances + lengths) * (lengths - crossing) - (lengths ** 2 - crossing ** 2) / 2
+
+    coeff = configs.ROAD_HEIGHT * configs.ROAD_WIDTH * configs.UNIT_COST
+
+    return coeff * (first_part + last_part)
+
+
+def compute_fermat_points(triangles: np.ndarray, n_iterations: int = 50):
+    """
+    Точки Ферма треугольников и выигрыш в длине сети от их добавления.
+
+    Если один из углов треугольника не меньше 120 градусов, точка Ферма совпадает с его вершиной. Иначе она
+    находится итерациями Вейсфельда, которые выполняются сразу для всех треугольников.
+
+    :param triangles: Массив формы (n_triangles, 3, 2).
+    :param n_iterations:
+    :return: Точки Ферма, массив формы (n_triangles, 2), и разность длины MST треугольника и суммы расстояний от
+    точки Ферма до его вершин.
+    """
 
-    return coeff * value
+    triangles = np.asarray(triangles, dtype=float)
+
+    points = triangles.mean(axis=1)
+    for _ in range(n_iterations):
+        distances = np.maximum(np.linalg.norm(triangles - points[:, np.newaxis], axis=2), 1e-12)
+        weights = 1 / distances
+        points = np.sum(triangles * weights[:, :, np.newaxis], axis=1) / np.sum(weights, axis=1, keepdims=True)
+
+    for ind in range(3):
+        first_vectors = triangles[:, (ind + 1) % 3] - triangles[:, ind]
+        second_vectors = triangles[:, (ind + 2) % 3] - triangles[:, ind]
+        norms = np.maximum(np.linalg.norm(first_vectors, axis=1) * np.linalg.norm(second_vectors, axis=1), 1e-12)
+        is_obtuse = np.sum(first_vectors * second_vectors, axis=1) / norms <= -0.5
+        points[is_obtuse] = triangles[is_obtuse, ind]
+
+    sides = np.linalg.norm(triangles - np.roll(triangles, 1, axis=1), axis=2)
+    mst_lengths = np.sum(sides, axis=1) - np.max(sides, axis=1)
+    steiner_lengths = np.sum(np.linalg.norm(triangles - points[:, np.newaxis], axis=2), axis=1)
+
+    return points, mst_lengths - steiner_lengths
+
+
+def compute_delaunay_fermat_points(points: np.ndarray):
+    """
+    Точки Ферма треугольников Делоне, построенных на точках.
+
+    :param points:
+    :return: Результат compute_fermat_points или None, если триангуляцию построить нельзя.
+    """
+    try:
+        tri = Delaunay(points)
+    except (QhullError, ValueError):
+        return None
+
+    return compute_fermat_points(points[tri.simplices])
+
+
+def compute_lattice_points(lower_left: np.ndarray, upper_right: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Узлы квадратной решетки из не более чем n_points точек, покрывающей прямоугольник.
+
+    :param lower_left:
+    :param upper_right:
+    :param n_points:
+    :return:
+    """
+    x = np.linspace(lower_left[0], upper_right[0], int(np.sqrt(n_points)))
+    y = np.linspace(lower_left[1], upper_right[1], int(np.sqrt(n_points)))
+
+    xv, yv = np.meshgrid(x, y)
+
+    return np.vstack((xv.flatten(), yv.flatten())).T
+
+
+def compute_steiner_candidate_points(terminal_points: np.ndarray) -> np.ndarray:
+    """
+    Положения начальных 'точек Штейнера' до привязки к сетке: узлы решетки или точки Ферма треугольников Делоне с
+    наибольшим выигрышем (configs.STEINER_POINTS_GENERATOR). NetworkBuilder привязывает их к сетке, а многоуровневая
+    сетка сгущается вокруг них. Точки, добавляемые при уточнении вокруг принятых точек, заранее неизвестны и не
+    учитываются.
+
+    :param terminal_points:
+    :return:
+    """
+    if configs.STEINER_POINTS_GENERATOR == "fermat":
+        fermat_points = compute_delaunay_fermat_points(terminal_points)
+        if fermat_points is not None:
+            points, savings = fermat_points
+            order = np.argsort(-savings, kind="stable")
+            order = order[savings[order] > 0]
+            return points[order[:configs.N_STEINER_CANDIDATES]]
+
+    return compute_lattice_points(np.min(terminal_points, axis=0), np.max(terminal_points, axis=0),
+                                  configs.N_STEINER_POINTS)
 
 
 def read_terminal_points(path_to_file: Path):